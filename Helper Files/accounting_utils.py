@@ -1,16 +1,29 @@
 import platform
 import logging
-import shutil
+import secrets
+import hashlib
+import tempfile
+import gzip
 import json
 import sys
 import csv
+import time
 import os
 from datetime import datetime
-from openpyxl.utils import get_column_letter
-import charset_normalizer
-from constants import VBA_ERROR_ALERT
+from timestamps import parse_timestamp, timestamp_to_date_str
+from constants import VBA_ERROR_ALERT, JOB_SERVER_AUTHKEY_FILE
+# openpyxl, charset_normalizer are imported inside functions using them: costly imports, not needed on early exit paths
 
 
+# GLOBAL VARIABLES
+ENCODING_SAMPLE_BYTES = 64 * 1024
+DIALECT_CACHE_JSON = 'file_dialect_cache.json'
+DIALECT_CACHE_MAX_ENTRIES = 50
+HASH_CHUNK_BYTES = 1024 * 1024
+SRC_FILES_COMPRESSION_LEVEL = 6
+AUTHKEY_BYTES = 32
+AUTHKEY_READ_RETRIES = 20
+
 def get_level_up_abspath(absdir_path):
     '''returns directory absolute path one level up from passed abs path'''
     return os.path.dirname(absdir_path)
@@ -29,18 +42,14 @@ def is_windows_machine() -> bool:
     machine_os = platform.system()
     return True if machine_os == 'Windows' else False
 
-def orders_column_to_file(orders:list, dict_key:str):
-    '''exports a column values of each orders list item for passed dict_key'''
-    try:
-        output_dir = get_output_dir()
-        fpath = os.path.join(output_dir, f'export {dict_key}.txt')
-        with open(fpath, 'w', encoding='utf-8', newline='\r\n') as f:
-            for order in orders:
-                f.write(f'{order[dict_key]}\r\n')
-            return fpath
-    except KeyError as e:
-        logging.exception(f'Provided {dict_key} does not exist in passed orders list of dicts')
-        return
+def orders_column_to_file(column_values:list, column_name:str):
+    '''exports orders column values (each on new line) to txt file named after column_name'''
+    output_dir = get_output_dir()
+    fpath = os.path.join(output_dir, f'export {column_name}.txt')
+    with open(fpath, 'w', encoding='utf-8', newline='\r\n') as f:
+        for value in column_values:
+            f.write(f'{value}\r\n')
+        return fpath
 
 def alert_vba_date_count(filter_date, orders_count):
     '''Passing two variables for VBA to display for user in message box'''
@@ -48,9 +57,9 @@ def alert_vba_date_count(filter_date, orders_count):
     print(f'SKIPPING_ORDERS_COUNT: {orders_count}')
 
 def get_datetime_obj(date_str: str, sales_channel: str):
-    '''returns tz-naive datetime obj from date string. Designed to work with str format: 2020-04-16T10:07:16+00:00'''
+    '''returns tz-naive datetime obj from date string (memoized, see timestamps). Designed to work with str format: 2020-04-16T10:07:16+00:00'''
     try:
-        return datetime.fromisoformat(date_str).replace(tzinfo=None)
+        return parse_timestamp(date_str)
     except ValueError:
         logging.critical(f'Change in date format at sales channel: {sales_channel}! Could not parse to datetime: {date_str}. Terminating...')
         print(VBA_ERROR_ALERT)
@@ -59,8 +68,7 @@ def get_datetime_obj(date_str: str, sales_channel: str):
 def simplify_date(date_str: str, sales_channel: str) -> str:
     '''returns a simplified date format: YYYY-MM-DD from rawformat 2020-04-16T06:53:44+00:00'''
     try:
-        date = get_datetime_obj(date_str, sales_channel).date()
-        return date.strftime('%Y-%m-%d')
+        return timestamp_to_date_str(date_str)
     except ValueError:
         logging.warning(f'Unable to return simplified version of date: {date_str}. Returning raw format instead')
         return date_str
@@ -69,35 +77,18 @@ def col_to_letter(col : int, zero_indexed=True) -> str:
     '''returns column letter from worksheet column index'''
     if zero_indexed:
         col += 1
+    from openpyxl.utils import get_column_letter
     return get_column_letter(col)
 
-def get_last_used_row_col(ws:object):
-    '''returns dictionary containing max_row and max_col as integers - last used row and column in passed openpyxl worksheet'''
-    row = ws.max_row
-    while row > 0:
-        cells = ws[row]
-        if all([cell.value is None for cell in cells]):
-            row -= 1
-        else:
-            break
-    if row == 0:
-        return {'max_row' : 0, 'max_col' : 0}
-
-    column = ws.max_column
-    while column > 0:
-        cells = next(ws.iter_cols(min_col=column, max_col=column, max_row=row))
-        if all([cell.value is None for cell in cells]):
-            column -= 1
-        else:
-            break
-    return {'max_row' : row, 'max_col' : column}
-
 def dump_to_json(export_obj, json_fname:str) -> str:
-    '''exports export_obj to json file. Returns path to crated json'''
+    '''exports export_obj to json file. Returns path to crated json. Written to temp file and swapped in:
+    concurrent readers (and writers) never see partially written json'''
     output_dir = get_output_dir(client_file=False)
     json_path = os.path.join(output_dir, json_fname)
-    with open(json_path, 'w', encoding='utf-8') as f:
+    temp_path = f'{json_path}.{os.getpid()}.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as f:
         json.dump(export_obj, f, indent=4)
+    os.replace(temp_path, json_path)
     return json_path
 
 def read_json_to_obj(json_file_path:str):
@@ -119,29 +110,91 @@ def get_EU_countries_from_txt(txt_abspath:str) -> list:
         print(VBA_ERROR_ALERT)
         exit()
 
-def get_order_tax(order: dict, proxy_keys: dict) -> float:
-    '''returns tax of order dict as float'''
-    tax = float(order[proxy_keys['item-tax']])
-    return round(tax, 2)
-
 def get_file_encoding_delimiter(fpath:str) -> tuple:
-    '''returns tuple of file encoding and delimiter'''
-    with open(fpath, mode='rb') as f_as_bytes:
-        try:
-            byte_contents = f_as_bytes.read()
-            enc_data = charset_normalizer.detect(byte_contents)
-            encoding = enc_data['encoding']
-        except Exception as e:
-            logging.warning(f'charset err: {e} when figuring out file {os.path.basename(fpath)} encoding. Defaulting to utf-8')
-            encoding = 'utf-8'
-
-    with open(fpath, mode='r', encoding=encoding) as f_text:
-        text_contents = f_text.read()
-        sniffer = csv.Sniffer()
-        dialect = sniffer.sniff(text_contents)
-        delimiter = dialect.delimiter if not dialect.delimiter == ' ' else '\t'
+    '''returns tuple of file encoding and delimiter. Detection runs on file sample (first ENCODING_SAMPLE_BYTES + header line),
+    rest of file is scanned only when sample is ambiguous (ascii). Results are cached per file path, size and modification time'''
+    dialect_cache = _read_dialect_cache()
+    cache_key = _get_dialect_cache_key(fpath)
+    if cache_key in dialect_cache:
+        encoding, delimiter = dialect_cache[cache_key]
+        logging.debug(f'Using cached encoding: {encoding}, delimiter <{delimiter}> for file {os.path.basename(fpath)}')
+        return encoding, delimiter
+
+    sample_bytes, whole_file_read = _read_file_sample(fpath, ENCODING_SAMPLE_BYTES)
+    encoding = _detect_encoding(sample_bytes, fpath)
+    # ascii sample says nothing about the rest of the file (sample ends on line boundary: rest is decodable on its own)
+    if not whole_file_read and (encoding is None or encoding.lower() == 'ascii'):
+        logging.info(f'Sample of {os.path.basename(fpath)} is ambiguous (detected encoding: {encoding}). Scanning rest of file')
+        with open(fpath, mode='rb') as f_as_bytes:
+            f_as_bytes.seek(len(sample_bytes))
+            rest_encoding = _detect_encoding(f_as_bytes.read(), fpath)
+        if rest_encoding is not None and rest_encoding.lower() != 'ascii':
+            encoding = rest_encoding
+
+    try:
+        delimiter = _sniff_delimiter(sample_bytes.decode(encoding, errors='ignore'))
+    except (csv.Error, LookupError, TypeError):
+        logging.info(f'Could not determine delimiter from {os.path.basename(fpath)} sample. Sniffing whole file')
+        with open(fpath, mode='r', encoding=encoding) as f_text:
+            delimiter = _sniff_delimiter(f_text.read())
+
+    _update_dialect_cache(dialect_cache, cache_key, encoding, delimiter)
     return encoding, delimiter
 
+def _read_file_sample(fpath:str, sample_size:int) -> tuple:
+    '''returns tuple of bytes sample (cut at last complete line, but always including header line) and flag if whole file was read'''
+    with open(fpath, mode='rb') as f_as_bytes:
+        sample = f_as_bytes.read(sample_size)
+        if len(sample) < sample_size:
+            return sample, True
+        if b'\n' not in sample:
+            sample += f_as_bytes.readline()
+        else:
+            sample = sample[:sample.rindex(b'\n') + 1]
+        whole_file_read = not f_as_bytes.read(1)
+    return sample, whole_file_read
+
+def _detect_encoding(byte_contents:bytes, fpath:str) -> str:
+    '''returns encoding of byte_contents as detected by charset_normalizer'''
+    import charset_normalizer
+    try:
+        enc_data = charset_normalizer.detect(byte_contents)
+        return enc_data['encoding']
+    except Exception as e:
+        logging.warning(f'charset err: {e} when figuring out file {os.path.basename(fpath)} encoding. Defaulting to utf-8')
+        return 'utf-8'
+
+def _sniff_delimiter(text_contents:str) -> str:
+    '''returns csv delimiter sniffed from text_contents (space delimiter is treated as tab)'''
+    sniffer = csv.Sniffer()
+    dialect = sniffer.sniff(text_contents)
+    return dialect.delimiter if not dialect.delimiter == ' ' else '\t'
+
+def _get_dialect_cache_key(fpath:str) -> str:
+    '''returns dialect cache key for file: abspath|size|mtime'''
+    f_stat = os.stat(fpath)
+    return f'{os.path.abspath(fpath)}|{f_stat.st_size}|{f_stat.st_mtime_ns}'
+
+def _read_dialect_cache() -> dict:
+    '''returns cached {cache_key: [encoding, delimiter]} dict, empty dict if cache is missing or unreadable'''
+    cache_path = os.path.join(get_output_dir(client_file=False), DIALECT_CACHE_JSON)
+    try:
+        return read_json_to_obj(cache_path)
+    except FileNotFoundError:
+        return {}
+    except Exception as e:
+        logging.warning(f'Could not read file dialect cache {cache_path}. Err: {e}. Ignoring cache')
+        return {}
+
+def _update_dialect_cache(dialect_cache:dict, cache_key:str, encoding:str, delimiter:str):
+    '''adds new entry to dialect cache, keeps only DIALECT_CACHE_MAX_ENTRIES most recent entries'''
+    dialect_cache[cache_key] = [encoding, delimiter]
+    recent_keys = list(dialect_cache.keys())[-DIALECT_CACHE_MAX_ENTRIES:]
+    try:
+        dump_to_json({key : dialect_cache[key] for key in recent_keys}, DIALECT_CACHE_JSON)
+    except Exception as e:
+        logging.warning(f'Could not update file dialect cache. Err: {e}')
+
 def delete_file(file_abspath:str):
     '''deletes file located in file_abspath'''
     try:
@@ -151,28 +204,65 @@ def delete_file(file_abspath:str):
     except Exception as e:
         logging.warning(f'Unexpected err: {e} while flushing db old records, deleting file: {file_abspath}')
 
-def create_src_file_backup(target_file_abs_path:str, backup_fname_prefix:str) -> str:
-    '''returns abspath of created file backup'''
+def get_file_hash(fpath:str) -> str:
+    '''returns sha256 hex digest of file contents'''
+    file_hash = hashlib.sha256()
+    with open(fpath, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_BYTES), b''):
+            file_hash.update(chunk)
+    return file_hash.hexdigest()
+
+def archive_src_file(target_file_abs_path:str) -> tuple:
+    '''returns tuple of compressed source file archive abspath, named by file contents hash: file_hash.ext.gz and file_hash.
+    Source is hashed while being compressed (single read) to temp file unique to caller. Each distinct source file
+    is archived once: temp file is discarded if same contents were already archived'''
     src_files_folder = get_src_files_folder()
-    _, backup_ext = os.path.splitext(target_file_abs_path)
-    backup_abspath = get_backup_f_abspath(src_files_folder, backup_fname_prefix, backup_ext)
-    shutil.copy(src=target_file_abs_path, dst=backup_abspath)
-    logging.info(f'Backup created at: {backup_abspath}')
-    return backup_abspath
+    _, src_ext = os.path.splitext(target_file_abs_path)
+    temp_fd, temp_abspath = tempfile.mkstemp(suffix=f'{src_ext}.gz.tmp', dir=src_files_folder)
+    os.close(temp_fd)
+    file_hash = hashlib.sha256()
+    with open(target_file_abs_path, 'rb') as f_src, gzip.open(temp_abspath, 'wb', compresslevel=SRC_FILES_COMPRESSION_LEVEL) as f_dst:
+        for chunk in iter(lambda: f_src.read(HASH_CHUNK_BYTES), b''):
+            file_hash.update(chunk)
+            f_dst.write(chunk)
+    file_hash = file_hash.hexdigest()
+    archive_abspath = os.path.join(src_files_folder, f'{file_hash}{src_ext}.gz')
+    if os.path.exists(archive_abspath):
+        delete_file(temp_abspath)
+        logging.info(f'Source file contents already archived at: {archive_abspath}')
+        return archive_abspath, file_hash
+    os.replace(temp_abspath, archive_abspath)
+    logging.info(f'Source file archived at: {archive_abspath}')
+    return archive_abspath, file_hash
 
 def get_src_files_folder():
     output_dir = get_output_dir(client_file=False)
     target_dir = os.path.join(output_dir, 'src files')
     if not os.path.exists(target_dir):
-        os.mkdir(target_dir)
+        # exist_ok: batch mode workers may create folder concurrently
+        os.makedirs(target_dir, exist_ok=True)
         logging.debug(f'src files directory inside Helper files has been recreated: {target_dir}')
     return target_dir
 
-def get_backup_f_abspath(src_files_folder:str, backup_fname_prefix:str, ext:str) -> str:
-    '''returns abs path for backup file. fname format: backup_fname_prefix-YY-MM-DD-HH-MM.ext'''
-    timestamp = datetime.now().strftime('%y-%m-%d %H-%M')
-    backup_fname = f'{backup_fname_prefix} {timestamp}{ext}'
-    return os.path.join(src_files_folder, backup_fname)
+def get_job_server_authkey() -> bytes:
+    '''returns job server / client authkey stored next to database (JOB_SERVER_AUTHKEY_FILE). Random key is generated
+    on first use, file is created exclusively (readable by owner only), concurrent first users read winner's key'''
+    key_path = os.path.join(get_output_dir(client_file=False), JOB_SERVER_AUTHKEY_FILE)
+    try:
+        fd = os.open(key_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        for _ in range(AUTHKEY_READ_RETRIES):
+            with open(key_path, 'r', encoding='utf-8') as f:
+                authkey = f.read().strip()
+            # key file may be created, not yet written by concurrent first user
+            if len(authkey) == AUTHKEY_BYTES * 2:
+                return authkey.encode()
+            time.sleep(0.05)
+        raise ValueError(f'Unexpected job server authkey in {key_path}. Delete file to generate new key')
+    authkey = secrets.token_hex(AUTHKEY_BYTES)
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        f.write(authkey)
+    return authkey.encode()
 
 def sum_formula_taxes_country(col: int, start_row: int, end_row: int) -> str:
     '''returns excel formula as string summing two ranges for country total + taxes'''
@@ -185,17 +275,6 @@ def sum_formula_total(col: int, start_row: int, end_row: int) -> str:
     col_let = col_to_letter(col, zero_indexed=False)
     return f'=SUM({col_let}{start_row}:{col_let}{end_row})'
 
-def is_gb_uk_order(country_code: str, zip_code: str) -> bool:
-    '''returns True if country is uk/gb and postcode does not belong to Northern Ireland
-    NOTE: currently not used'''
-    if country_code.upper() in ['GB', 'UK']:
-        capitalized_zip = zip_code.upper()
-        if capitalized_zip.startswith('BT') or capitalized_zip.startswith('GY'):
-            return False
-        else:
-            return True
-    return False
-
 
 if __name__ == "__main__":
     pass
\ No newline at end of file
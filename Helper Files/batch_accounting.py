@@ -0,0 +1,102 @@
+import multiprocessing
+import logging
+import time
+import sys
+import os
+from concurrent.futures import ProcessPoolExecutor
+from accounting_utils import get_output_dir, read_json_to_obj
+from db_backup import SQLiteBackup
+from orders_db import DATABASE_PATH, DB_BACKUPS_FOLDER, BACKUP_LABEL_BEFORE, BACKUP_LABEL_AFTER
+from storage import get_storage
+from constants import SALES_CHANNEL_PROXY_KEYS, VBA_ERROR_ALERT
+import main_accounting
+
+
+# GLOBAL VARIABLES
+MAX_WORKERS = os.cpu_count() or 1
+# worker process global: sales channel : lock serializing database dedup / insert of channel jobs. Set by _init_worker
+_CHANNEL_LOCKS = {}
+
+
+def parse_batch_args(argv:list) -> list:
+    '''returns batch jobs as list of (source_fpath, sales_channel) from cli args. Accepted forms:
+    batch_accounting.py <manifest.json> - json list of {"file": source_fpath, "channel": sales_channel} (as main_accounting.TEST_CASES)
+    batch_accounting.py <source_fpath1> <sales_channel1> <source_fpath2> <sales_channel2> ...'''
+    try:
+        if len(argv) == 2:
+            jobs = [(job['file'], job['channel']) for job in read_json_to_obj(argv[1])]
+        else:
+            assert len(argv) >= 3 and len(argv) % 2 == 1, 'Expected manifest path or (source file, sales channel) pairs'
+            jobs = list(zip(argv[1::2], argv[2::2]))
+        assert jobs, 'No jobs provided'
+        for _, sales_channel in jobs:
+            assert sales_channel in SALES_CHANNEL_PROXY_KEYS.keys(), f'Unexpected sales_channel value: {sales_channel}'
+        logging.info(f'Accepted {len(jobs)} batch jobs: {jobs}')
+        return jobs
+    except Exception as e:
+        print(VBA_ERROR_ALERT)
+        logging.critical(f'Error parsing batch arguments. Arguments provided: {list(argv)}. Err: {e}')
+        exit()
+
+def _init_worker(channel_locks:dict):
+    '''pool worker initializer, shares channel locks created in parent process'''
+    _CHANNEL_LOCKS.update(channel_locks)
+
+def _run_batch_job(source_fpath:str, sales_channel:str) -> tuple:
+    '''runs single job in worker process, returns VBA status tokens output by run and run duration in seconds.
+    Parsing and report export run in parallel, database dedup and new orders claim are serialized per sales channel'''
+    start = time.perf_counter()
+    output = main_accounting.run_job([__file__, source_fpath, sales_channel],
+                                    channel_lock=_CHANNEL_LOCKS[sales_channel], db_backups=False)
+    return output, time.perf_counter() - start
+
+def run_batch(jobs:list) -> list:
+    '''runs jobs in process pool, returns list of (source_fpath, sales_channel, status output, seconds) in jobs order.
+    Database is set up and backed up once before and after the whole batch'''
+    db_path = os.path.join(get_output_dir(client_file=False), DATABASE_PATH)
+    get_storage(main_accounting.DB_BACKEND, db_path).close()
+    _backup_db(db_path, BACKUP_LABEL_BEFORE)
+    channel_locks = {sales_channel : multiprocessing.Lock() for _, sales_channel in jobs}
+    workers = min(len(jobs), MAX_WORKERS)
+    logging.info(f'Running {len(jobs)} batch jobs in {workers} worker processes')
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(channel_locks,)) as pool:
+        futures = [pool.submit(_run_batch_job, source_fpath, sales_channel) for source_fpath, sales_channel in jobs]
+        results = []
+        for (source_fpath, sales_channel), future in zip(jobs, futures):
+            try:
+                output, seconds = future.result()
+            except Exception as e:
+                logging.critical(f'Batch job {sales_channel}: {source_fpath} failed in worker process. Err: {e}')
+                output, seconds = VBA_ERROR_ALERT, 0
+            results.append((source_fpath, sales_channel, output, seconds))
+    _backup_db(db_path, BACKUP_LABEL_AFTER)
+    return results
+
+def _backup_db(db_path:str, label:str):
+    '''creates database backup for whole batch (see OrdersDB._backup_db)'''
+    if main_accounting.TESTING:
+        return
+    try:
+        backup_path = SQLiteBackup(db_path, os.path.join(os.path.dirname(db_path), DB_BACKUPS_FOLDER)).backup(label)
+        logging.info(f'Batch database backup {label}: {backup_path}')
+    except Exception as e:
+        logging.warning(f'Failed to create batch database backup {label}. Err: {e}')
+
+def print_summary(results:list):
+    '''prints and logs per job status (last VBA token output by job) and duration'''
+    for source_fpath, sales_channel, output, seconds in results:
+        tokens = output.split('\n')
+        status = [token for token in tokens if token.strip()][-1] if output.strip() else VBA_ERROR_ALERT
+        summary = f'{status} | {sales_channel} | {os.path.basename(source_fpath)} | {seconds:.1f}s'
+        logging.info(f'Batch job summary: {summary}. Full job output: {tokens}')
+        print(summary)
+
+def main():
+    '''Batch entry point: runs several (source file, sales channel) jobs in parallel worker processes'''
+    jobs = parse_batch_args(sys.argv)
+    print_summary(run_batch(jobs))
+
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    main()
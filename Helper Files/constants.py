@@ -115,4 +115,8 @@ VBA_ERROR_ALERT = 'ERROR_CALL_DADDY'
 VBA_KEYERROR_ALERT = 'ERROR_IN_SOURCE_HEADERS'
 VBA_COUNTRYLESS_ALERT = 'ERROR_COUNTRYLESS'
 VBA_OK = 'EXPORTED_SUCCESSFULLY'
-VBA_NO_NEW_JOB = 'NO NEW JOB'
\ No newline at end of file
+VBA_NO_NEW_JOB = 'NO NEW JOB'
+# resident job server (job_server.py) local address, shared with job_client.py
+JOB_SERVER_ADDRESS = ('localhost', 6021)
+# per-user random authkey file next to database (see accounting_utils.get_job_server_authkey)
+JOB_SERVER_AUTHKEY_FILE = 'job_server.key'
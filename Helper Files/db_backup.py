@@ -0,0 +1,223 @@
+import datetime
+import logging
+import sqlite3
+import shutil
+import json
+import gzip
+import glob
+import os
+from accounting_utils import delete_file
+
+
+# GLOBAL VARIABLES
+# backup chains (full backup followed by its delta backups) kept
+BACKUP_GENERATIONS = 6
+# delta backups after which next backup is full again (bounds restore work, amortizes full copy cost)
+BACKUP_DELTAS_PER_BASE = 20
+BACKUP_STEP_PAGES = 1024
+BACKUP_COMPRESSION_LEVEL = 6
+BACKUP_MANIFEST_NAME = 'backups.json'
+FULL_BACKUP_EXT = '.db.gz'
+DELTA_BACKUP_EXT = '.delta.json.gz'
+# orders database changes by whole runs: delta holds RUN_TABLE rows (and rows of other tables referencing them) of runs
+# added or changed (confirmed claims) since previous backup and ids of runs deleted or changed since (flushed, released claims)
+RUN_TABLE = 'program_run'
+DELTA_TABLES = {'program_run' : 'id', 'order' : 'run'}
+# run ids per 'IN (...)' delta query (below SQLite host parameters limit)
+DELTA_QUERY_RUN_IDS = 500
+# full copies of database next to it, made before and after each run by previous program versions
+LEGACY_BACKUP_SUFFIXES = ['_b4lrun.db', '_lrun.db']
+
+
+class SQLiteBackup():
+    '''Online, compressed, rotating incremental SQLite orders database backups. Main methods:
+
+    backup(label) - full backup: database copied with SQLite online backup API (page-stepped, consistent while database
+    is in use), gzipped to backup_dir as '<db name> <label> <timestamp>.db.gz'. Delta backup: only rows of runs added
+    since previous backup (DELTA_TABLES, run index lookups) and ids of runs deleted since, gzipped as
+    '<db name> <label> <timestamp>.delta.json.gz'. Full backup is made when chain has BACKUP_DELTAS_PER_BASE deltas,
+    schema version changed or no full backup exists, delta otherwise; unchanged database is not backed up at all.
+    Changes are detected from fingerprint: schema version and (id, timestamp, confirmed) of each run (scan of small runs table only).
+    Newest BACKUP_GENERATIONS chains are kept. Legacy full copies next to database are deleted once backed up here.
+
+    restore(target_path) - rebuilds database at target_path from newest chain: full backup with its deltas applied
+
+    Arguments:
+
+    db_path - abs path to database file
+
+    backup_dir - abs path to directory for backups and manifest (created if missing)'''
+
+    def __init__(self, db_path: str, backup_dir: str):
+        self.db_path = db_path
+        self.backup_dir = backup_dir
+        self.db_name, _ = os.path.splitext(os.path.basename(db_path))
+        self.manifest_path = os.path.join(backup_dir, BACKUP_MANIFEST_NAME)
+        if not os.path.exists(backup_dir):
+            os.mkdir(backup_dir)
+            logging.debug(f'Database backups directory has been created: {backup_dir}')
+
+    def backup(self, label: str) -> str:
+        '''creates full or delta compressed backup of database, returns its path. Returns None if database did not change since last backup'''
+        manifest = self._read_manifest()
+        chains = manifest.get('chains', [])
+        src_conn = sqlite3.connect(self.db_path, isolation_level=None)
+        try:
+            # fingerprint and delta rows are read in single snapshot
+            src_conn.execute('BEGIN')
+            fingerprint = self._get_fingerprint(src_conn)
+            if fingerprint == manifest.get('fingerprint'):
+                logging.info(f'Database unchanged since last backup. Skipping {label} backup')
+                src_conn.execute('COMMIT')
+                self._remove_legacy_backups()
+                return None
+            if self._is_full_backup_due(fingerprint, manifest.get('fingerprint'), chains):
+                src_conn.execute('COMMIT')
+                backup_path = self._get_backup_path(label, FULL_BACKUP_EXT)
+                self._backup_compressed(src_conn, backup_path)
+                chains.append({'base' : backup_path, 'deltas' : []})
+            else:
+                backup_path = self._get_backup_path(label, DELTA_BACKUP_EXT)
+                self._backup_delta(src_conn, backup_path, fingerprint, manifest['fingerprint'])
+                src_conn.execute('COMMIT')
+                chains[-1]['deltas'].append(backup_path)
+        finally:
+            src_conn.close()
+        kept_chains = chains[-BACKUP_GENERATIONS:]
+        self._write_manifest({'fingerprint' : fingerprint, 'last_backup' : backup_path, 'chains' : kept_chains})
+        self._rotate(chains[:-BACKUP_GENERATIONS])
+        self._remove_legacy_backups()
+        return backup_path
+
+    def _get_backup_path(self, label: str, ext: str) -> str:
+        '''returns unused backup path: '<db name> <label> <timestamp>[ n]<ext>' (backups within same second are numbered)'''
+        timestamp = datetime.datetime.now().strftime('%y-%m-%d %H-%M-%S')
+        backup_path = os.path.join(self.backup_dir, f'{self.db_name} {label} {timestamp}{ext}')
+        backup_n = 1
+        while os.path.exists(backup_path):
+            backup_n += 1
+            backup_path = os.path.join(self.backup_dir, f'{self.db_name} {label} {timestamp} {backup_n}{ext}')
+        return backup_path
+
+    @staticmethod
+    def _get_fingerprint(conn: object) -> dict:
+        '''returns database content fingerprint: schema version, [id, timestamp, confirmed] of each run (run id may be re-used
+        after newest run is deleted, timestamp tells runs apart; confirmed claim is changed run)'''
+        return {'user_version' : conn.execute('PRAGMA user_version').fetchone()[0],
+                'runs' : [list(run) for run in conn.execute(f'SELECT id, timestamp, confirmed FROM "{RUN_TABLE}" ORDER BY id')]}
+
+    def _is_full_backup_due(self, fingerprint: dict, last_fingerprint: dict, chains: list) -> bool:
+        '''returns True if delta can not be applied on top of last chain (or chain has BACKUP_DELTAS_PER_BASE deltas)'''
+        if not chains or not isinstance(last_fingerprint, dict) or not os.path.exists(chains[-1]['base']):
+            return True
+        # fingerprint of previous program version (no runs list): changes since can not be told
+        if 'runs' not in last_fingerprint:
+            return True
+        return len(chains[-1]['deltas']) >= BACKUP_DELTAS_PER_BASE or fingerprint['user_version'] != last_fingerprint.get('user_version')
+
+    def _backup_compressed(self, src_conn: object, backup_path: str):
+        '''copies database via online backup API in BACKUP_STEP_PAGES steps to temp file, gzips it to backup_path'''
+        temp_path = f'{backup_path}.tmp'
+        dst_conn = sqlite3.connect(temp_path)
+        try:
+            src_conn.backup(dst_conn, pages=BACKUP_STEP_PAGES)
+        finally:
+            dst_conn.close()
+        with open(temp_path, 'rb') as f_src, gzip.open(backup_path, 'wb', compresslevel=BACKUP_COMPRESSION_LEVEL) as f_dst:
+            shutil.copyfileobj(f_src, f_dst)
+        delete_file(temp_path)
+
+    @staticmethod
+    def _backup_delta(src_conn: object, backup_path: str, fingerprint: dict, last_fingerprint: dict):
+        '''writes rows of runs added after last backup (all DELTA_TABLES) and ids of runs deleted since to gzipped json at backup_path.
+        Runs are compared by [id, timestamp, confirmed]: changed run (confirmed claim, deleted run's id re-used) is both deleted and added'''
+        runs = {tuple(run) for run in fingerprint['runs']}
+        last_runs = {tuple(run) for run in last_fingerprint['runs']}
+        added_run_ids = sorted(run[0] for run in runs - last_runs)
+        delta = {'user_version' : fingerprint['user_version'],
+                'deleted_run_ids' : sorted(run[0] for run in last_runs - runs),
+                'tables' : {}}
+        for table, run_column in DELTA_TABLES.items():
+            table_delta = {'columns' : [], 'rows' : []}
+            for i in range(0, len(added_run_ids), DELTA_QUERY_RUN_IDS):
+                run_ids = added_run_ids[i:i + DELTA_QUERY_RUN_IDS]
+                cursor = src_conn.execute(f'SELECT * FROM "{table}" WHERE "{run_column}" IN ({", ".join("?" * len(run_ids))})', run_ids)
+                table_delta['columns'] = [column[0] for column in cursor.description]
+                table_delta['rows'].extend(cursor.fetchall())
+            delta['tables'][table] = table_delta
+        temp_path = f'{backup_path}.tmp'
+        with gzip.open(temp_path, 'wt', encoding='utf-8', compresslevel=BACKUP_COMPRESSION_LEVEL) as f:
+            json.dump(delta, f)
+        os.replace(temp_path, backup_path)
+
+    def restore(self, target_path: str):
+        '''rebuilds database at target_path (overwritten) from newest backup chain: decompressed full backup, deltas applied in order'''
+        chains = self._read_manifest().get('chains')
+        if not chains:
+            raise FileNotFoundError(f'No database backups listed in {self.manifest_path}')
+        with gzip.open(chains[-1]['base'], 'rb') as f_src, open(target_path, 'wb') as f_dst:
+            shutil.copyfileobj(f_src, f_dst)
+        conn = sqlite3.connect(target_path)
+        try:
+            for delta_path in chains[-1]['deltas']:
+                with gzip.open(delta_path, 'rt', encoding='utf-8') as f:
+                    self._apply_delta(conn, json.load(f))
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _apply_delta(conn: object, delta: dict):
+        '''deletes runs deleted before delta, inserts delta rows, in single transaction.
+        Deltas of previous program version list min run id instead (runs below it were flushed)'''
+        with conn:
+            for table, run_column in reversed(list(DELTA_TABLES.items())):
+                conn.executemany(f'DELETE FROM "{table}" WHERE "{run_column}" = ?', [(run_id,) for run_id in delta.get('deleted_run_ids', [])])
+                if delta.get('min_run_id') is not None:
+                    conn.execute(f'DELETE FROM "{table}" WHERE "{run_column}" < ?', (delta['min_run_id'],))
+            for table, table_delta in delta['tables'].items():
+                if not table_delta['rows']:
+                    continue
+                columns = ', '.join(f'"{column}"' for column in table_delta['columns'])
+                placeholders = ', '.join('?' * len(table_delta['columns']))
+                conn.executemany(f'INSERT OR REPLACE INTO "{table}" ({columns}) VALUES ({placeholders})', table_delta['rows'])
+
+    def _rotate(self, old_chains: list):
+        '''deletes full and delta backups of chains beyond BACKUP_GENERATIONS newest'''
+        for chain in old_chains:
+            for old_backup in [chain['base']] + chain['deltas']:
+                delete_file(old_backup)
+                logging.debug(f'Rotated out old database backup: {old_backup}')
+
+    def _remove_legacy_backups(self):
+        '''deletes full database copies made by previous program versions next to database, once backups exist here'''
+        db_stem = os.path.splitext(self.db_path)[0]
+        for legacy_path in [db_stem + suffix for suffix in LEGACY_BACKUP_SUFFIXES]:
+            if os.path.exists(legacy_path):
+                delete_file(legacy_path)
+                logging.info(f'Deleted legacy database backup {legacy_path}, superseded by backups in {self.backup_dir}')
+
+    def _read_manifest(self) -> dict:
+        '''returns backups manifest dict. Missing / unreadable manifest: full backups found in backup_dir
+        (previous program versions) are adopted as chains without deltas, so they keep rotating'''
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+            if 'chains' in manifest:
+                return manifest
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logging.warning(f'Could not read database backups manifest {self.manifest_path}. Err: {e}')
+        full_backups = sorted(glob.glob(os.path.join(glob.escape(self.backup_dir), f'{glob.escape(self.db_name)} *{FULL_BACKUP_EXT}')), key=os.path.getmtime)
+        return {'chains' : [{'base' : full_backup, 'deltas' : []} for full_backup in full_backups]}
+
+    def _write_manifest(self, manifest: dict):
+        '''writes backups manifest to temp file in backup_dir, replaces manifest with it (interrupted write leaves previous manifest)'''
+        temp_path = f'{self.manifest_path}.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=4)
+        os.replace(temp_path, self.manifest_path)
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,59 @@
+import multiprocessing
+import sys
+import os
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client
+from accounting_utils import get_job_server_authkey
+from constants import JOB_SERVER_ADDRESS, VBA_ERROR_ALERT
+
+
+# GLOBAL VARIABLES
+STOP_SERVER_ARG = '--stop-server'
+SHUTDOWN_REQUEST = 'SHUTDOWN'   # same as job_server.SHUTDOWN_REQUEST (not imported: job_server imports whole program)
+PROFILE_STARTUP_ARG = '--profile-startup'   # same as startup_profiler.PROFILE_STARTUP_ARG
+FILE_ARG_INDEX = 1
+
+
+def get_server_request(argv: list) -> list:
+    '''returns job request for server from cli args: source file arg resolved against client's working directory
+    (server runs in its own), PROFILE_STARTUP_ARG stripped (measures cold start of in-process run only)'''
+    request = [arg for arg in argv if arg != PROFILE_STARTUP_ARG]
+    if len(request) > FILE_ARG_INDEX:
+        request[FILE_ARG_INDEX] = os.path.abspath(request[FILE_ARG_INDEX])
+    return request
+
+def send_to_server(conn: object, request) -> str:
+    '''sends request to resident job server over conn, returns its reply'''
+    with conn:
+        conn.send(request)
+        return conn.recv()
+
+def main():
+    '''Thin client with main_accounting.py cli contract: same args, same VBA status tokens on stdout.
+    Passes job to resident job server (job_server.py), runs it in this process if server is not running.
+    Failures after connecting print VBA_ERROR_ALERT: job may already be committed by server, running it again is unsafe'''
+    try:
+        conn = Client(JOB_SERVER_ADDRESS, authkey=get_job_server_authkey())
+    except AuthenticationError as e:
+        print(f'Job server on {JOB_SERVER_ADDRESS} rejected authkey. Err: {e}', file=sys.stderr)
+        print(VBA_ERROR_ALERT)
+        return
+    except OSError:
+        if STOP_SERVER_ARG in sys.argv:
+            return
+        import main_accounting
+        main_accounting.main()
+        return
+    request = SHUTDOWN_REQUEST if STOP_SERVER_ARG in sys.argv else get_server_request(sys.argv)
+    try:
+        output = send_to_server(conn, request)
+    except (OSError, EOFError, AuthenticationError) as e:
+        print(f'Lost job server connection. Err: {e}', file=sys.stderr)
+        print(VBA_ERROR_ALERT)
+        return
+    print(output, end='')
+
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    main()
@@ -0,0 +1,61 @@
+import multiprocessing
+import logging
+import os
+from multiprocessing.connection import Listener
+import main_accounting
+from accounting_utils import get_output_dir, get_job_server_authkey
+from orders_db import DATABASE_PATH
+from storage import get_storage
+from constants import JOB_SERVER_ADDRESS
+
+
+# GLOBAL VARIABLES
+SHUTDOWN_REQUEST = 'SHUTDOWN'
+
+
+class JobServer():
+    '''Resident local job server. Keeps program modules imported, database engine and EU countries list warm
+    between exports, so VBA launched runs (through job_client.py) do not pay interpreter and imports start-up.
+    Main method:
+
+    serve() - accepts jobs on JOB_SERVER_ADDRESS (authenticated with per-user key, see get_job_server_authkey) one at a time.
+    Job is argv list (same as sys.argv of main_accounting.py), answered with VBA status tokens printed by the run.
+    SHUTDOWN_REQUEST message stops the server.
+
+    Arguments:
+
+    address - optional (host, port) to listen on'''
+
+    def __init__(self, address: tuple=JOB_SERVER_ADDRESS):
+        self.address = address
+
+    def serve(self):
+        '''warms up heavy modules and database, serves jobs until SHUTDOWN_REQUEST'''
+        self._warm_up()
+        with Listener(self.address, authkey=get_job_server_authkey()) as listener:
+            logging.info(f'Job server listening on {self.address}')
+            while True:
+                try:
+                    with listener.accept() as conn:
+                        request = conn.recv()
+                        if request == SHUTDOWN_REQUEST:
+                            conn.send('')
+                            break
+                        conn.send(main_accounting.run_job(request))
+                except Exception as e:
+                    logging.warning(f'Failed to serve job server connection. Err: {e}')
+        logging.info(f'Job server on {self.address} stopped')
+
+    @staticmethod
+    def _warm_up():
+        '''imports modules otherwise loaded lazily by program stages, opens database storage (schema set up, engine pooled)'''
+        import charset_normalizer
+        import reports
+        db_path = os.path.join(get_output_dir(client_file=False), DATABASE_PATH)
+        get_storage(main_accounting.DB_BACKEND, db_path).close()
+        logging.info(f'Job server warmed up: report modules imported, {main_accounting.DB_BACKEND} storage opened for {db_path}')
+
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    JobServer().serve()
@@ -1,14 +1,19 @@
+from startup_profiler import StartupProfiler, pop_profile_startup_arg
+import multiprocessing
+import contextlib
 import logging
 import sys
 import csv
+import io
 import os
 from datetime import datetime
-import sqlalchemy.sql.default_comparator    #neccessary for executable packing
-from accounting_utils import get_output_dir, get_datetime_obj, alert_vba_date_count
+from accounting_utils import get_output_dir, alert_vba_date_count
 from accounting_utils import get_file_encoding_delimiter, delete_file, dump_to_json, orders_column_to_file
+from order_record import OrderRecord
+from parallel_csv import is_parallel_readable, read_rows_parallel
 from parse_orders import ParseOrders
-from orders_db import SQLAlchemyOrdersDB
-from constants import SALES_CHANNEL_PROXY_KEYS, VBA_ERROR_ALERT, VBA_KEYERROR_ALERT, VBA_OK, VBA_COUNTRYLESS_ALERT
+from orders_db import OrdersDB
+from constants import SALES_CHANNEL_PROXY_KEYS, VBA_ERROR_ALERT, VBA_KEYERROR_ALERT, VBA_OK, VBA_NO_NEW_JOB, VBA_COUNTRYLESS_ALERT
 
 
 TEST_CASES = [
@@ -26,6 +31,11 @@ TEST_TODAY_DATE = datetime.now().strftime('%Y-%m-%d')   # Hardcode in format: '2
 SALES_CHANNEL = TEST_CASE['channel']
 ORDERS_SOURCE_FILE = TEST_CASE['file']
 EXPECTED_SYS_ARGS = 3
+DB_BACKEND = 'sqlalchemy'  # orders database storage backend: 'sqlalchemy' / 'sqlite3'
+
+# Heavy modules (openpyxl, sqlalchemy, charset_normalizer) are imported lazily in stages using them.
+# Pass --profile-startup (in addition to expected args) to report import and stage timings
+PROFILER = StartupProfiler(enabled=pop_profile_startup_arg())
 
 # Logging config:
 log_path = os.path.join(get_output_dir(client_file=False), 'report.log')
@@ -33,23 +43,41 @@ logging.basicConfig(handlers=[logging.FileHandler(log_path, 'a', 'utf-8')], leve
 
 
 def get_cleaned_orders(source_file:str, sales_channel:str, proxy_keys:dict) -> list:
-    '''returns cleaned orders (as cleaned in clean_orders func) from source_file arg path'''
+    '''returns cleaned orders as OrderRecord objects from source_file arg path.
+    Reading, today's orders filter, parsing to OrderRecord and countryless filter run in single pass over file'''
     encoding, delimiter = get_file_encoding_delimiter(source_file)
     logging.info(f'{os.path.basename(source_file)} detected encoding: {encoding}, delimiter <{delimiter}>')
-    raw_orders = get_raw_orders(source_file, encoding, delimiter)
-    logging.info(f'Loaded {os.path.basename(source_file)} has {len(raw_orders)} raw orders. Filtering out todays orders...')
-    cleaned_orders = remove_todays_orders(raw_orders, sales_channel, proxy_keys)
+    raw_orders = get_raw_orders(source_file, encoding, delimiter, proxy_keys)
     if TESTING:
+        raw_orders = list(raw_orders)
         replace_old_testing_json(raw_orders, 'DEBUG_raw_all.json')
-        replace_old_testing_json(cleaned_orders, 'DEBUG_filtred_todays.json')
+    order_records = get_order_records(raw_orders, sales_channel, proxy_keys)
+    orders_until_today = remove_todays_orders(order_records)
+    cleaned_orders = remove_countryless(orders_until_today, proxy_keys)
+    if TESTING:
+        replace_old_testing_json([order.to_dict() for order in cleaned_orders], 'DEBUG_filtred_todays.json')
     return cleaned_orders
 
-def get_raw_orders(source_file:str, encoding:str, delimiter:str) -> list:
-    '''returns raw orders as list of dicts for each order in txt source_file'''
-    with open(source_file, 'r', encoding=encoding) as f:
-        source_contents = csv.DictReader(f, delimiter=delimiter)
-        raw_orders = [{header : value for header, value in row.items()} for row in source_contents]
-    return raw_orders
+def get_raw_orders(source_file:str, encoding:str, delimiter:str, proxy_keys:dict):
+    '''generator yielding raw order dict for each order in txt source_file. Only columns mapped in proxy_keys are kept.
+    Large files are parsed in parallel chunks (parallel_csv), sequentially if not possible (records spanning several lines)'''
+    try:
+        with open(source_file, 'r', encoding=encoding) as f:
+            source_contents = csv.DictReader(f, delimiter=delimiter)
+            proxy_headers = set(proxy_keys.values())
+            used_headers = [header for header in source_contents.fieldnames or [] if header in proxy_headers]
+            if used_headers and is_parallel_readable(source_file, encoding):
+                rows = read_rows_parallel(source_file, encoding, delimiter, used_headers)
+                if rows is not None:
+                    for row in rows:
+                        yield dict(zip(used_headers, row))
+                    return
+            for row in source_contents:
+                yield {header : row[header] for header in used_headers}
+    except (UnicodeDecodeError, csv.Error) as e:
+        logging.critical(f'Err: {e} reading source file {os.path.basename(source_file)} (encoding: {encoding}, delimiter <{delimiter}>). Alerting VBA')
+        print(VBA_ERROR_ALERT)
+        exit()
 
 def replace_old_testing_json(raw_orders, json_fname:str):
     '''deletes old json, exports raw orders to json file'''
@@ -58,28 +86,39 @@ def replace_old_testing_json(raw_orders, json_fname:str):
     delete_file(json_path)
     dump_to_json(raw_orders, json_fname)
 
-def remove_todays_orders(orders: list, sales_channel: str, proxy_keys: dict) -> list:
-    '''returns a list of orders dicts, whose purchase date up to, but not including today's date (deletes todays orders), alerts VBA'''
-    try:
-        today_date = get_today_obj()
-        # for VBA, logging, constructing str representation
-        today_str = today_date.strftime('%Y-%m-%d')
-        
-        logging.info(f'Filter date used in program: {today_date}. Passing to vba and logging strftime format: {today_str}')
-        orders_until_today = list(filter(lambda order: get_datetime_obj(order[proxy_keys['payments-date']], sales_channel) < today_date, orders))
-        not_processing_count = len(orders) - len(orders_until_today)
-
-        alert_vba_date_count(today_str, not_processing_count)
-        logging.info(f'Orders passed today date filtering: {len(orders_until_today)}/{len(orders)}')
-        return orders_until_today
-    except KeyError as e:
-        logging.critical(f'Err: {e} in remove_todays_orders method. Probable key not found: payments-date, (sales channel: {sales_channel})')
-        print(VBA_KEYERROR_ALERT)
-        exit()
-    except Exception as e:
-        logging.critical(f'Unknown error: {e} while filtering out todays orders. Date used: {today_date}; sales_channel: {sales_channel}')
-        print(VBA_ERROR_ALERT)
-        exit()
+def remove_todays_orders(orders):
+    '''generator yielding OrderRecord orders, whose payments date is up to, but not including today's date (skips todays orders),
+    alerts VBA once passed orders are exhausted'''
+    today_date = get_today_obj()
+    # for VBA, logging, constructing str representation
+    today_str = today_date.strftime('%Y-%m-%d')
+    
+    logging.info(f'Filter date used in program: {today_date}. Passing to vba and logging strftime format: {today_str}')
+    loaded_count, passed_count = 0, 0
+    for order in orders:
+        loaded_count += 1
+        if order.payments_datetime < today_date:
+            passed_count += 1
+            yield order
+    not_processing_count = loaded_count - passed_count
+
+    alert_vba_date_count(today_str, not_processing_count)
+    logging.info(f'Loaded source file has {loaded_count} raw orders. Orders passed today date filtering: {passed_count}/{loaded_count}')
+
+def get_order_records(orders, sales_channel: str, proxy_keys: dict):
+    '''generator yielding OrderRecord parsed from each raw order dict. Only order parsing errors are handled here:
+    source file reading errors surface from upstream generator'''
+    for order in orders:
+        try:
+            yield OrderRecord.from_order_dict(order, proxy_keys)
+        except KeyError as e:
+            logging.critical(f'Err: {e} parsing order. Probable proxy key not found in source file headers, (sales channel: {sales_channel}). Order: {order}')
+            print(VBA_KEYERROR_ALERT)
+            exit()
+        except (ValueError, TypeError) as e:
+            logging.critical(f'Err: {e} parsing order. Could not parse date, (sales channel: {sales_channel}). Order: {order}')
+            print(VBA_ERROR_ALERT)
+            exit()
 
 def get_today_obj(): 
     '''returns instance of datetime library corresponding to date (no time) for today used in rest of program'''
@@ -89,58 +128,97 @@ def get_today_obj():
         dt_today_date_only = datetime.today().strftime('%Y-%m-%d')
         return datetime.strptime(dt_today_date_only, '%Y-%m-%d')
 
-def remove_countryless(orders: list, proxy_keys: dict) -> list:
-    '''removes orders w/o defined country, alerts VBA, exports IDs to txt file if present'''
-    logging.debug(f'Before countryless filter: {len(orders)} orders')
-    countryless = list(filter(lambda x: x[proxy_keys['ship-country']] == '', orders))
+def remove_countryless(orders, proxy_keys: dict) -> list:
+    '''returns orders with defined country, splitting them from countryless ones in single pass.
+    Alerts VBA, exports countryless IDs to txt file if present'''
+    valid_orders, countryless = [], []
+    for order in orders:
+        if order.ship_country == '':
+            countryless.append(order)
+        else:
+            valid_orders.append(order)
+    logging.debug(f'Before countryless filter: {len(valid_orders) + len(countryless)} orders')
     if countryless:
         logging.info(f'Removed {len(countryless)} country-less orders')
-        fpath = orders_column_to_file(countryless, proxy_keys['secondary-order-id'])
+        fpath = orders_column_to_file([order.secondary_order_id for order in countryless], proxy_keys['secondary-order-id'])
         print(VBA_COUNTRYLESS_ALERT)
         logging.info(f'Country-less orders have been exported to txt {fpath} file, VBA alerted. Proceeding...')
-    return list(filter(lambda x: x[proxy_keys['ship-country']] != '', orders))
+    return valid_orders
+
+def exit_source_file_processed(db_client:object):
+    '''terminates before parsing if source file with same contents was already processed today, alerting VBA'''
+    if db_client.is_source_file_processed():
+        logging.info(f'Source file contents already processed today. Terminating, closing database connection, alerting VBA.')
+        db_client.close_connection()
+        print(VBA_NO_NEW_JOB)
+        exit()
 
-def parse_args():
-    '''returns source_fpath, sales_channel from cli args or hardcoded testing variables'''    
+def parse_args(argv:list):
+    '''returns source_fpath, sales_channel from cli args (argv, as sys.argv) or hardcoded testing variables'''
     if TESTING:
         print(f'--- RUNNING IN TESTING MODE. Using hardcoded args ch: {SALES_CHANNEL}, f: {os.path.basename(ORDERS_SOURCE_FILE)}---')
         logging.warning('--- RUNNING IN TESTING MODE. Using hardcoded args---')
         assert SALES_CHANNEL in SALES_CHANNEL_PROXY_KEYS.keys(), f'Unexpected sales_channel value passed from VBA side: {SALES_CHANNEL}'
         return ORDERS_SOURCE_FILE, SALES_CHANNEL
     try:
-        assert len(sys.argv) == EXPECTED_SYS_ARGS, 'Unexpected number of sys.args passed. Check TESTING mode'
-        source_fpath = sys.argv[1]
-        sales_channel = sys.argv[2]
-        logging.info(f'Accepted sys args on launch: source_fpath: {source_fpath}; sales_channel: {sales_channel}. Whole sys.argv: {list(sys.argv)}')
+        assert len(argv) == EXPECTED_SYS_ARGS, 'Unexpected number of sys.args passed. Check TESTING mode'
+        source_fpath = argv[1]
+        sales_channel = argv[2]
+        logging.info(f'Accepted sys args on launch: source_fpath: {source_fpath}; sales_channel: {sales_channel}. Whole argv: {list(argv)}')
         assert sales_channel in SALES_CHANNEL_PROXY_KEYS.keys(), f'Unexpected sales_channel value passed from VBA side: {sales_channel}'
         return source_fpath, sales_channel
     except Exception as e:
         print(VBA_ERROR_ALERT)
-        logging.critical(f'Error parsing arguments on script initialization in cmd. Arguments provided: {list(sys.argv)} Number Expected: {EXPECTED_SYS_ARGS}. Err: {e}')
+        logging.critical(f'Error parsing arguments on script initialization in cmd. Arguments provided: {list(argv)} Number Expected: {EXPECTED_SYS_ARGS}. Err: {e}')
         exit()
 
-def main():
-    '''Main function executing parsing of provided txt file and outputing csv, xlsx files'''    
+def main(argv:list=None, channel_lock:object=None, db_backups:bool=True):
+    '''Main function executing parsing of provided txt file and outputing csv, xlsx files.
+    argv - cli args as sys.argv (default), passed explicitly by job_server / batch_accounting for each job.
+    channel_lock - optional lock held around database dedup and claiming new orders (same channel jobs running in parallel).
+    Report is exported outside of lock, claim is released if export fails.
+    db_backups - False suspends per run database backups'''
     logging.info(f'\n NEW RUN STARTING: {datetime.today().strftime("%Y.%m.%d %H:%M")}')    
-    source_fpath, sales_channel = parse_args()
+    with PROFILER.stage('parse_args'):
+        source_fpath, sales_channel = parse_args(sys.argv if argv is None else argv)
     proxy_keys = SALES_CHANNEL_PROXY_KEYS[sales_channel]
     logging.debug(f'Loading file: {os.path.basename(source_fpath)}. Using proxy keys matching key: {sales_channel} in SALES_CHANNEL_PROXY_KEYS')
 
-    # Get cleaned (filter out today's orders) source orders
-    cleaned_source_orders = get_cleaned_orders(source_fpath, sales_channel, proxy_keys)
-
-    # dont store / evaluate country-less orders
-    valid_orders = remove_countryless(cleaned_source_orders, proxy_keys)
-
-    db_client = SQLAlchemyOrdersDB(valid_orders, source_fpath, sales_channel, proxy_keys, testing=TESTING)
-    new_orders = db_client.get_new_orders_only()
-    logging.info(f'Loaded file contains: {len(cleaned_source_orders)} (b4 {TEST_TODAY_DATE} date and countryless filters. Further processing: {len(new_orders)} orders')
-
-    # Parse orders, export target files
-    ParseOrders(new_orders, db_client, sales_channel, proxy_keys).export_orders(TESTING)
+    with PROFILER.stage('open_db'):
+        db_client = OrdersDB(source_fpath, sales_channel, proxy_keys, testing=TESTING, backend=DB_BACKEND, backups=db_backups)
+    with db_client:
+        with PROFILER.stage('source_check'):
+            exit_source_file_processed(db_client)
+
+        # Get cleaned source orders (filter out today's orders, dont store / evaluate country-less orders)
+        with PROFILER.stage('clean_orders'):
+            valid_orders = get_cleaned_orders(source_fpath, sales_channel, proxy_keys)
+        with channel_lock or contextlib.nullcontext():
+            with PROFILER.stage('new_orders'):
+                new_orders = db_client.get_new_orders_only(valid_orders)
+                db_client.claim_new_orders()
+        logging.info(f'Loaded file contains: {len(valid_orders)} orders after {TEST_TODAY_DATE} date and countryless filters. Further processing: {len(new_orders)} orders')
+
+        # Parse orders, export target files
+        with PROFILER.stage('export'):
+            ParseOrders(new_orders, db_client, sales_channel, proxy_keys).export_orders(TESTING)
     print(VBA_OK)
     logging.info(f'\nRUN ENDED: {datetime.today().strftime("%Y.%m.%d %H:%M")}\n')
 
+def run_job(argv:list, **main_kwargs) -> str:
+    '''runs main with argv (and main_kwargs) in current process, returns everything run printed (VBA status tokens).
+    exit() calls on failures / early termination end the job, not the calling process'''
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        try:
+            main(list(argv), **main_kwargs)
+        except SystemExit:
+            pass
+        except Exception:
+            logging.exception(f'Unexpected error running job: {argv}. Alerting VBA')
+            print(VBA_ERROR_ALERT)
+    return output.getvalue()
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support()
     main()
\ No newline at end of file
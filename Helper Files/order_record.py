@@ -0,0 +1,80 @@
+from operator import attrgetter
+from timestamps import parse_timestamp, timestamp_to_date_str
+
+
+# GLOBAL VARIABLES
+# OrderRecord attribute : proxy key (as in SALES_CHANNEL_PROXY_KEYS) of order value
+TEXT_FIELDS = {
+    'order_id' : 'order-id',
+    'secondary_order_id' : 'secondary-order-id',
+    'buyer_name' : 'buyer-name',
+    'recipient_name' : 'recipient-name',
+    'quantity_purchased' : 'quantity-purchased',
+    'currency' : 'currency',
+    'ship_postal_code' : 'ship-postal-code',
+    'ship_country' : 'ship-country',
+}
+# simplified to YYYY-MM-DD on parsing
+DATE_FIELDS = {
+    'purchase_date' : 'purchase-date',
+    'payments_date' : 'payments-date',
+}
+NUMBER_FIELDS = {
+    'item_price' : 'item-price',
+    'item_tax' : 'item-tax',
+    'shipping_price' : 'shipping-price',
+    'shipping_tax' : 'shipping-tax',
+}
+FIELD_BY_PROXY_KEY = {proxy_key : field for field, proxy_key in {**TEXT_FIELDS, **DATE_FIELDS, **NUMBER_FIELDS}.items()}
+
+
+class OrderRecord():
+    '''Compact typed order representation used through the whole program instead of raw export dicts.
+    Parsed once from raw order dict (source file row) using sales channel proxy keys (SALES_CHANNEL_PROXY_KEYS):
+    text values are kept as is, dates are simplified to YYYY-MM-DD. Prices and taxes are kept as raw strings until
+    parse_numbers() converts them to floats: only new orders reaching report are converted,
+    malformed numbers of countryless or already processed orders do not abort a run.
+
+    payments_datetime - tz-naive payments date datetime, used by today's orders filter. Timestamps are parsed once per distinct raw value (timestamps)
+
+    region - order region (bucket), assigned once by regions.RegionClassifier
+
+    Raises KeyError if order lacks proxy key, ValueError / TypeError if date can not be parsed'''
+    __slots__ = tuple(TEXT_FIELDS) + tuple(DATE_FIELDS) + tuple(NUMBER_FIELDS) + ('payments_datetime', 'region')
+
+    @classmethod
+    def from_order_dict(cls, order: dict, proxy_keys: dict) -> 'OrderRecord':
+        '''returns new OrderRecord parsed from raw order dict'''
+        record = cls()
+        for field, proxy_key in TEXT_FIELDS.items():
+            setattr(record, field, order[proxy_keys[proxy_key]])
+        for field, proxy_key in DATE_FIELDS.items():
+            setattr(record, field, timestamp_to_date_str(order[proxy_keys[proxy_key]]))
+        record.payments_datetime = parse_timestamp(order[proxy_keys['payments-date']])
+        for field, proxy_key in NUMBER_FIELDS.items():
+            setattr(record, field, order[proxy_keys[proxy_key]])
+        record.region = None
+        return record
+
+    def parse_numbers(self):
+        '''converts prices and taxes to floats in place. Raises ValueError / TypeError if number can not be converted'''
+        for field in NUMBER_FIELDS:
+            setattr(self, field, float(getattr(self, field)))
+
+    def to_dict(self) -> dict:
+        '''returns order fields as dict (for json dumps while testing), payments_datetime in iso format'''
+        order_dict = {field : getattr(self, field) for field in self.__slots__}
+        order_dict['payments_datetime'] = self.payments_datetime.isoformat()
+        return order_dict
+
+    def __repr__(self) -> str:
+        return f'<OrderRecord order_id: {self.order_id}, secondary_order_id: {self.secondary_order_id}, payments_date: {self.payments_date}>'
+
+
+def get_fields_getter(proxy_keys: list):
+    '''returns callable, returning tuple of OrderRecord values for passed list of proxy keys'''
+    return attrgetter(*[FIELD_BY_PROXY_KEY[proxy_key] for proxy_key in proxy_keys])
+
+
+if __name__ == "__main__":
+    pass
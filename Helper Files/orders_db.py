@@ -1,94 +1,53 @@
 import datetime
 import logging
+import threading
 import os
-import shutil
-from sqlalchemy import create_engine, Column, String, Integer
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, relationship
-from sqlalchemy.sql.sqltypes import TIMESTAMP
-from sqlalchemy.sql.schema import ForeignKey
-from sqlalchemy.exc import IntegrityError
-from accounting_utils import get_output_dir, create_src_file_backup, delete_file
+from accounting_utils import get_output_dir, get_file_hash, archive_src_file, delete_file
+from db_backup import SQLiteBackup
+from storage import get_storage
 from constants import VBA_ERROR_ALERT
 
 
 # GLOBAL VARIABLES
 ORDERS_ARCHIVE_DAYS = 120
+# old records are flushed in batches: once oldest run is this many days past ORDERS_ARCHIVE_DAYS
+FLUSH_BATCH_DAYS = 7
 DATABASE_PATH = 'amzn_accounting.db'
-BACKUP_DB_BEFORE_NAME = 'amzn_accounting_b4lrun.db'
-BACKUP_DB_AFTER_NAME = 'amzn_accounting_lrun.db'
+DB_BACKUPS_FOLDER = 'db backups'
+BACKUP_LABEL_BEFORE = 'b4lrun'
+BACKUP_LABEL_AFTER = 'lrun'
+# incoming orders count from which dedup is performed inside SQLite (temp table anti-join)
+DEDUP_IN_DB_MIN_ORDERS = 50000
+DEFAULT_STORAGE_BACKEND = 'sqlalchemy'
+# unconfirmed claims older than this are left by killed runs (no report exported): released on next start
+STALE_CLAIM_MINUTES = 30
 
 
-Base = declarative_base()
+class OrdersDB():
+    '''Orders Database management. Main methods:
 
+    is_source_file_processed() - checks if source file with same contents was already processed today for sales channel.
+    Expected to be called before parsing source file to short-circuit duplicate runs.
 
-class ProgramRun(Base):
-    '''database table model representing unique program run'''
-    __tablename__ = 'program_run'
-
-    def __init__(self, fpath:str, sales_channel, timestamp=datetime.datetime.now(), **kwargs):
-        super(ProgramRun, self).__init__(**kwargs)
-        self.fpath = fpath
-        self.sales_channel = sales_channel
-        self.timestamp = timestamp
-
-    id = Column(Integer, primary_key=True, nullable=False)
-    fpath = Column(String, nullable=False)
-    sales_channel = Column(String, nullable=False)      # AmazonEU / AmazonCOM / Amazon Warehouse
-    timestamp = Column(TIMESTAMP(timezone=False), default=datetime.datetime.now())
-    orders = relationship('Order', cascade='all, delete', cascade_backrefs=True,
-                passive_deletes=False, passive_updates=False, backref='run_obj')
+    get_new_orders_only(orders) - from passed orders returns only ones, not yet in database.
+    Expected to be called outside of this cls to get self.new_orders var.
 
-    def __repr__(self) -> str:
-        return f'<ProgramRun id: {self.id}, sales_channel: {self.sales_channel}, timestamp: {self.timestamp}, fpath: {self.fpath}>'
-    
+    claim_new_orders() - inserts new orders (returned list from get_new_orders_only() method) with new run right after
+    dedup, so concurrent same channel runs see them as processed while this run exports report. Claim is released
+    (run and its orders deleted) if connection is closed or with block left before add_orders_to_db() confirms it.
+    Claims of killed runs (never confirmed nor released) are released by next run started STALE_CLAIM_MINUTES later.
 
-class Order(Base):
-    '''database table model representing Order
+    add_orders_to_db() - confirms claimed new orders after successful export (claims them first if not claimed yet),
+    performs backups before and after each run, periodic flushing of old entries 
     
-    NOTE: unique primary key is:
-        order['order-item-id'] for Amazon (AmazonEU / AmazonCOM);
-        order['Shipment Item ID'] for Amazon Warehouse;
-
-        order_id_secondary:
-        order['order-id'] for Amazon;
-        order['Amazon Order Id'] for Amazon Warehouse;
-    '''
-    __tablename__ = 'order'
-
-    def __init__(self, order_id, purchase_date, buyer_name, run, **kwargs):
-        super(Order, self).__init__(**kwargs)
-        self.order_id = order_id
-        self.purchase_date = purchase_date
-        self.buyer_name = buyer_name
-        self.run = run
-
-    order_id = Column(String, primary_key=True, nullable=False)
-    order_id_secondary = Column(String)
-    purchase_date = Column(String)
-    buyer_name = Column(String)
-    run = Column(Integer, ForeignKey('program_run.id', ondelete='CASCADE', onupdate='CASCADE'), nullable=False)
-
-    def __repr__(self) -> str:
-        return f'<Order order_id: {self.order_id}, added on run: {self.run}>'
-
-
-class SQLAlchemyOrdersDB:
-    '''Orders Database management. Two main methods:
+    Database access goes through storage backend (storage.OrdersStorage), selected on startup by backend argument.
+    Intended to be used as context manager, closing connection on leaving with block (including exit() calls on failures).
 
-    get_new_orders_only() - from passed orders to cls returns only ones, not yet in database.
-    Expected to be called outside of this cls to get self.new_orders var.
-
-    add_orders_to_db() - pushes new orders (returned list from get_new_orders_only() method)
-    selected data to database, performs backups before and after each run, periodic flushing of old entries 
-    
     IMPORTANT NOTE: Amazon has unique order-item-id's (same order-id for different items in buyer's cart).
     Order model saves order['order-item-id'] for Amazon orders
     
     Arguments:
 
-    orders - list of dict / OrderedDict's
-
     source_file_path - abs path to source file for orders AmazonCOM / AmazonEU / Amazon Warehouse)
 
     sales_channel - str identifier for db entry, backup file naming. Expected value: ['AmazonCOM', 'AmazonEU', 'Amazon Warehouse']
@@ -96,148 +55,224 @@ class SQLAlchemyOrdersDB:
     proxy_keys - dict mapper of internal (based on amazon) order keys vs external sales_channel keys 
 
     testing - optional flag for testing (suspending backup, save add source_file_path to program_run table instead)
+
+    backend - optional storage backend name: 'sqlite3' (standard library) or 'sqlalchemy' (ORM). Same on-disk schema
+
+    backups - optional flag, False suspends database backups of this instance (batch mode backs up once per batch instead)
     '''
 
-    def __init__(self, orders: list, source_file_path: str, sales_channel: str, proxy_keys: dict, testing: bool=False):
-        self.orders = orders
+    def __init__(self, source_file_path: str, sales_channel: str, proxy_keys: dict, testing: bool=False, backend: str=DEFAULT_STORAGE_BACKEND, backups: bool=True):
         self.source_file_path = source_file_path
         self.sales_channel = sales_channel
         self.proxy_keys = proxy_keys
         self.testing = testing
-        self.__setup_db()
-        self._backup_db(self.db_backup_b4_path)
-        self.session = self.get_session()
-
-    def __setup_db(self):
+        self.backups = backups
+        self.source_size = os.path.getsize(source_file_path)
+        self.claimed_run_id = None
+        self.added_to_db_counter = 0
         self.__get_db_paths()
-        if not os.path.exists(self.db_path):
-            self.__get_engine()
-            Base.metadata.create_all(bind=self.engine)
-            logging.info(f'Database has been created at {self.db_path}')
+        self.storage = get_storage(backend, self.db_path)
+        self._release_stale_claims()
+        self._backup_db(BACKUP_LABEL_BEFORE)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        '''releases unconfirmed claim, closes connection on leaving with block. Unexpected errors (not exit() calls) are passed to storage as failures'''
+        self._release_claim()
+        self.storage.close(failed=exc_type is not None and not issubclass(exc_type, SystemExit))
+        return False
 
     def __get_db_paths(self):
         output_dir = get_output_dir(client_file=False)
         self.db_path = os.path.join(output_dir, DATABASE_PATH)
-        self.db_backup_b4_path = os.path.join(output_dir, BACKUP_DB_BEFORE_NAME)
-        self.db_backup_after_path = os.path.join(output_dir, BACKUP_DB_AFTER_NAME)
+        self.db_backups_dir = os.path.join(output_dir, DB_BACKUPS_FOLDER)
 
-    def __get_engine(self):
-        engine_path = f'sqlite:///{self.db_path}'
-        self.engine = create_engine(engine_path, echo=False)
-    
-    def get_session(self):
-        '''returns database session object to work outside the scope of class. For example querying'''
-        self.__get_engine()
-        Session = sessionmaker(bind=self.engine)
-        return Session()
-
-    def add_orders_to_db(self):
-        '''filters passed orders to cls to only those, whose order_id
-        (db table unique constraint) is not present in db yet adds them to db
+    def claim_new_orders(self):
+        '''adds self.new_orders (order_id unique constraint skips ids already present) with new run to db in single transaction.
+        Called right after get_new_orders_only under channel lock, before report export. Skipped in testing (nothing is stored)'''
+        if self.testing or not self.new_orders or self.claimed_run_id is not None:
+            return
+        try:
+            self._add_new_orders_to_db(self.new_orders)
+        except Exception as e:
+            logging.critical(f'Unexpected err {e} trying to add orders to db. Alerting VBA, terminating program immediately via exit().')
+            print(VBA_ERROR_ALERT)
+            exit()
+
+    def _release_claim(self):
+        '''deletes claimed run and its orders if claim was not confirmed by add_orders_to_db (export failed / terminated)'''
+        if self.claimed_run_id is None:
+            return
+        try:
+            deleted_count = self.storage.delete_run(self.claimed_run_id)
+            logging.warning(f'Export did not complete. Released claimed run id: {self.claimed_run_id}, {deleted_count} orders deleted from db')
+        except Exception as e:
+            logging.critical(f'Failed to release claimed run id: {self.claimed_run_id}. Its orders stay in db without exported report. Err: {e}')
+        self.claimed_run_id = None
+
+    def _release_stale_claims(self):
+        '''deletes unconfirmed runs (and their orders) claimed over STALE_CLAIM_MINUTES ago: left by runs killed before
+        export completed, their orders would otherwise be skipped as processed without any report'''
+        stale_before = datetime.datetime.now() - datetime.timedelta(minutes=STALE_CLAIM_MINUTES)
+        try:
+            released_runs = self.storage.delete_unconfirmed_runs_before(stale_before)
+        except Exception as e:
+            logging.warning(f'Failed to release stale claims. Err: {e}')
+            return
+        for run_id, orders_count in released_runs.items():
+            logging.warning(f'Released stale claim of killed run id: {run_id}, {orders_count} orders deleted from db')
+
+    def add_orders_to_db(self) -> int:
+        '''confirms orders claimed by claim_new_orders (claims them now if not claimed yet) after successful export,
+        flushes old records, returns count of actually added orders.
         assumes get_new_orders_only was called outside of this cls before to get self.new_orders'''
         try:
             if self.new_orders:
-                self._add_new_orders_to_db(self.new_orders)
+                self.claim_new_orders()
+                if self.claimed_run_id is not None:
+                    self.storage.confirm_run(self.claimed_run_id)
+                self.claimed_run_id = None
                 self.flush_old_records()
-                self._backup_db(self.db_backup_after_path)
-            logging.debug(f'{len(self.new_orders)} (order count) new orders added, flushing old records complete, backup after created at: {self.db_backup_after_path}')
-            return len(self.new_orders)
+                self._backup_db(BACKUP_LABEL_AFTER)
+            logging.debug(f'{self.added_to_db_counter} (order count) new orders added, flushing old records complete')
+            return self.added_to_db_counter
         except Exception as e:
             logging.critical(f'Unexpected err {e} trying to add orders to db. Alerting VBA, terminating program immediately via exit().')
             print(VBA_ERROR_ALERT)
             exit()
 
     def _add_new_orders_to_db(self, new_orders:list):
-        '''create new entry in program_runs table, add new orders'''
-        self.new_run = self._add_new_run()
-        self.added_to_db_counter = 0
-        for order in new_orders:
-            self._add_single_order(order)
-        logging.debug(f'{self.added_to_db_counter} new orders added to db (actual counter of commits)')
-            
-    def _add_single_order(self, order_dict:dict):
-        '''adds single order to database (via session.add(new_order))'''
-        try:
-            new_order = Order(order_id = order_dict[self.proxy_keys['order-id']],
-                            purchase_date = order_dict[self.proxy_keys['purchase-date']],
-                            buyer_name = order_dict[self.proxy_keys['buyer-name']],
-                            run = self.new_run.id)
-            # Leaving, in case Etsy gets integrated at some point in the future
-            if self.new_run.sales_channel != 'Etsy':
-                # Additionally add original order-id (may have duplicates for multiple items in shopping cart) for AmazonCOM, AmazonEU
-                # Both Amazon and Amazon Warehouse have 'secondary-order-id' secondary key
-                new_order.order_id_secondary = order_dict[self.proxy_keys['secondary-order-id']]
-            
-            self.session.add(new_order)
-            self.session.commit()
-            self.added_to_db_counter += 1
-        except IntegrityError as e:
-            logging.warning(f'Order from channel: {self.sales_channel} w/ proxy order-id: {order_dict[self.proxy_keys["order-id"]]} \
-                already in database. Integrity error {e}. Skipping addition of said order, rolling back db session')
-            self.session.rollback()
-
-    def _add_new_run(self) -> object:
-        '''adds new row in program_run table, returns new run object (attributes: id, sales_channel, fpath, timestamp),
-        creates source file backup, saves its path. On testing - save original file path'''        
-        backup_path = self.source_file_path if self.testing else create_src_file_backup(self.source_file_path, self.sales_channel)
+        '''adds new run to program_run table, bulk inserts new orders in single transaction.
+        Orders already present in db (order_id unique constraint) are skipped via INSERT OR IGNORE'''
+        run_row = self._get_new_run_row()
+        order_rows = [self._get_order_row(order) for order in new_orders]
+        self.claimed_run_id, self.added_to_db_counter = self.storage.add_run_orders(run_row, order_rows)
+        logging.debug(f'Added new run id: {self.claimed_run_id}, {run_row}')
+        if self.added_to_db_counter < len(new_orders):
+            logging.warning(f'{len(new_orders) - self.added_to_db_counter} orders from channel: {self.sales_channel} already in database. Skipped their addition')
+        logging.debug(f'{self.added_to_db_counter} new orders added to db (actual count of inserted rows)')
+
+    def _get_order_row(self, order:object) -> dict:
+        '''returns order table row (column: value dict, without run column) for single OrderRecord'''
+        order_row = {'order_id' : order.order_id,
+                    'order_id_secondary' : None,
+                    'purchase_date' : order.purchase_date,
+                    'buyer_name' : order.buyer_name,
+                    'sales_channel' : self.sales_channel}
+        # Leaving, in case Etsy gets integrated at some point in the future
+        if self.sales_channel != 'Etsy':
+            # Additionally add original order-id (may have duplicates for multiple items in shopping cart) for AmazonCOM, AmazonEU
+            # Both Amazon and Amazon Warehouse have 'secondary-order-id' secondary key
+            order_row['order_id_secondary'] = order.secondary_order_id
+        return order_row
+
+    def _get_new_run_row(self) -> dict:
+        '''returns program_run table row for new run (column: value dict, without id), creates source file archive
+        (hashing source in same pass), saves its path. On testing - save original file path'''
+        if self.testing:
+            backup_path, source_hash = self.source_file_path, get_file_hash(self.source_file_path)
+        else:
+            backup_path, source_hash = archive_src_file(self.source_file_path)
         logging.debug(f'This is backup path being saved to program_run fpath column: {backup_path}')
-        new_run = ProgramRun(fpath=backup_path, sales_channel=self.sales_channel)
-        self.session.add(new_run)
-        self.session.commit()
-        logging.debug(f'Added new run: {new_run}, created backup')
-        return new_run
-
-    def get_new_orders_only(self) -> list:
-        '''From passed orders to cls, returns only orders NOT YET in database.
-        Called from main_accounting.py to filter old, parsed orders'''
-        orders_in_db = self._get_channel_order_ids_in_db()
-        self.new_orders = [order_data for order_data in self.orders if order_data[self.proxy_keys['order-id']] not in orders_in_db]
-        logging.info(f'Returning {len(self.new_orders)}/{len(self.orders)} new/loaded orders for further processing')
+        return {'fpath' : backup_path, 'sales_channel' : self.sales_channel, 'timestamp' : datetime.datetime.now(),
+                'source_hash' : source_hash, 'source_size' : self.source_size, 'confirmed' : False}
+
+    def is_source_file_processed(self) -> bool:
+        '''returns True if run with same source file contents (hash) was added today for sales channel.
+        Source is hashed only if today's runs of sales channel include same size source (otherwise hashed once, when archived).
+        Limited to today's runs: same file processed on later date may contain orders skipped by today's orders filter'''
+        today_start = datetime.datetime.combine(datetime.date.today(), datetime.time())
+        same_size_hashes = self.storage.get_source_hashes(self.sales_channel, self.source_size, today_start)
+        if not same_size_hashes:
+            logging.info(f'No source of same size ({self.source_size} bytes) processed today for {self.sales_channel}')
+            return False
+        source_hash = get_file_hash(self.source_file_path)
+        is_processed = source_hash in same_size_hashes
+        logging.info(f'Source file hash: {source_hash}, already processed today for {self.sales_channel}: {is_processed}')
+        return is_processed
+
+    def get_new_orders_only(self, orders: list) -> list:
+        '''From passed orders, returns only orders NOT YET in database.
+        Called from main_accounting.py to filter old, parsed orders. For large inputs (DEDUP_IN_DB_MIN_ORDERS)
+        incoming ids are anti-joined inside database instead of loading channel history to python'''
+        if len(orders) >= DEDUP_IN_DB_MIN_ORDERS:
+            new_order_ids = self._get_new_order_ids_in_db({order.order_id for order in orders})
+            self.new_orders = [order for order in orders if order.order_id in new_order_ids]
+        else:
+            orders_in_db = self._get_channel_order_ids_in_db()
+            self.new_orders = [order for order in orders if order.order_id not in orders_in_db]
+        logging.info(f'Returning {len(self.new_orders)}/{len(orders)} new/loaded orders for further processing')
         return self.new_orders
 
-    def _get_channel_order_ids_in_db(self) -> list:
-        '''returns a list of order ids currently present in 'orders' database table for current run self.sales_channel'''
-        db_orders_of_sales_channel = self.session.query(Order).join(ProgramRun).filter(ProgramRun.sales_channel==self.sales_channel).all()
+    def _get_channel_order_ids_in_db(self) -> set:
+        '''returns a set of order ids currently present in 'orders' database table for current run self.sales_channel'''
         # Unlikely conflict: Etsy / Amazon EU having same order-(item-)id as AmazonCOM or similar permutations between sales channels and id's
-        order_id_lst_in_db = [order_obj.order_id for order_obj in db_orders_of_sales_channel]
-        logging.debug(f'Before inserting new orders, orders table contains {len(order_id_lst_in_db)} entries associated with {self.sales_channel} channel')
-        return order_id_lst_in_db
-
-    def flush_old_records(self):
-        '''deletes old runs, associated backup files and orders (deleting runs delete cascade associated orders)'''
-        old_runs = self._get_old_runs()
+        order_ids_in_db = self.storage.get_channel_order_ids(self.sales_channel)
+        logging.debug(f'Before inserting new orders, orders table contains {len(order_ids_in_db)} entries associated with {self.sales_channel} channel')
+        return order_ids_in_db
+
+    def _get_new_order_ids_in_db(self, incoming_order_ids:set) -> set:
+        '''returns incoming_order_ids not present in 'orders' table for self.sales_channel, anti-joined inside database'''
+        new_order_ids = self.storage.get_new_order_ids(self.sales_channel, incoming_order_ids)
+        logging.debug(f'Anti-joined {len(incoming_order_ids)} incoming order ids inside database, {len(new_order_ids)} not yet in db for {self.sales_channel} channel')
+        return new_order_ids
+
+    def flush_old_records(self, force:bool=False):
+        '''deletes runs (and their orders) added ORDERS_ARCHIVE_DAYS (global var) or more days ago in few set-based statements,
+        deletes associated source file backups in background thread after commit.
+        Sweep runs on own schedule: only once oldest run is FLUSH_BATCH_DAYS past archive period, unless force=True'''
+        delete_before_this_timestamp = datetime.datetime.now() - datetime.timedelta(days=ORDERS_ARCHIVE_DAYS)
+        if not force and not self._is_flush_due(delete_before_this_timestamp):
+            return
         try:
-            for run in old_runs:
-                orders_in_run = self.session.query(Order).filter_by(run_obj=run).all()
-                logging.info(f'Deleting {len(orders_in_run)} orders associated with old {run} and backup file: {run.fpath}')
-                delete_file(run.fpath)   
-                self.session.delete(run)
-            self.session.commit()
+            old_runs, orders_per_run = self.storage.delete_runs_before(delete_before_this_timestamp)
         except Exception as e:
-            logging.warning(f'Unexpected err while flushing old records from db inside flush_old_records. Err: {e}. Last recorded run {run}')
-            self.session.rollback()
-
-    def _get_old_runs(self):
-        '''returns runs that were added ORDERS_ARCHIVE_DAYS (global var) or more days ago'''
-        delete_before_this_timestamp = datetime.datetime.now() - datetime.timedelta(days=ORDERS_ARCHIVE_DAYS)        
-        runs = self.session.query(ProgramRun).filter(ProgramRun.timestamp < delete_before_this_timestamp).all()
-        return runs
-
-    def _backup_db(self, backup_db_path):
-        '''creates database backup file at backup_db_path in production (testing = False)'''
-        if self.testing:
-            logging.debug(f'Backup for {os.path.basename(backup_db_path)} suspended due to testing: {self.testing}')
+            logging.warning(f'Unexpected err while flushing old records from db inside flush_old_records. Err: {e}')
+            return
+        if not old_runs:
+            return
+        for run_id, fpath in old_runs:
+            logging.info(f'Deleted {orders_per_run.get(run_id, 0)} orders associated with old run id: {run_id} and backup file: {fpath}')
+        logging.info(f'Flushed {len(old_runs)} old runs, {sum(orders_per_run.values())} orders from database')
+        # archived source files are content addressed, newer runs may still reference same file
+        old_fpaths = {fpath for _, fpath in old_runs}
+        self._delete_files_in_background(list(old_fpaths - self.storage.get_referenced_fpaths(old_fpaths)))
+
+    def _is_flush_due(self, delete_before_this_timestamp:datetime.datetime) -> bool:
+        '''returns True if oldest run in database is FLUSH_BATCH_DAYS (global var) older than archive period'''
+        oldest_run_timestamp = self.storage.get_oldest_run_timestamp()
+        flush_due_timestamp = delete_before_this_timestamp - datetime.timedelta(days=FLUSH_BATCH_DAYS)
+        return oldest_run_timestamp is not None and oldest_run_timestamp < flush_due_timestamp
+
+    @staticmethod
+    def _delete_files_in_background(fpaths:list):
+        '''deletes files in single non-daemon thread (finishes before interpreter exit) off the main program path'''
+        def delete_files():
+            for fpath in fpaths:
+                delete_file(fpath)
+            logging.debug(f'Deleted {len(fpaths)} old source file backups')
+        threading.Thread(target=delete_files, name='old_backups_cleanup').start()
+
+    def _backup_db(self, label:str):
+        '''creates compressed full or delta (runs added since last backup) database backup in DB_BACKUPS_FOLDER in production
+        (testing = False). Skipped if database did not change since last backup, removes legacy full copies (see SQLiteBackup)'''
+        if self.testing or not self.backups:
+            logging.debug(f'Backup {label} suspended due to testing: {self.testing}, backups: {self.backups}')
             return
         try:
-            shutil.copy(src=self.db_path, dst=backup_db_path)
-            logging.info(f"New database backup {os.path.basename(backup_db_path)} created on: "
-                        f"{datetime.datetime.today().strftime('%Y-%m-%d %H:%M')} location: {backup_db_path}")
+            backup_path = SQLiteBackup(self.db_path, self.db_backups_dir).backup(label)
+            if backup_path:
+                logging.info(f"New database backup {label} created on: "
+                            f"{datetime.datetime.today().strftime('%Y-%m-%d %H:%M')} location: {backup_path}")
         except Exception as e:
-            logging.warning(f'Failed to create database backup for {os.path.basename(backup_db_path)}. Err: {e}')
+            logging.warning(f'Failed to create database backup {label}. Err: {e}')
     
     def close_connection(self):
-        '''closes db session'''
-        self.session.close()
+        '''releases unconfirmed claim, closes storage backend connection'''
+        self._release_claim()
+        self.storage.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,102 @@
+import multiprocessing
+import logging
+import csv
+import io
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+
+# GLOBAL VARIABLES
+# source files from this size are parsed in parallel chunks
+PARALLEL_MIN_FILE_BYTES = 64 * 1024 * 1024
+CHUNK_BYTES = 16 * 1024 * 1024
+MAX_WORKERS = os.cpu_count() or 1
+
+
+def is_parallel_readable(fpath:str, encoding:str) -> bool:
+    '''returns True if file at fpath is large enough for parallel parsing, can be split on b'\\n' in given encoding
+    (single byte newline, e.g. not utf-16) and current process is not a worker (batch mode) itself'''
+    try:
+        single_byte_newline = '\n'.encode(encoding) == b'\n'
+    except LookupError:
+        return False
+    # process name check instead of multiprocessing.parent_process() (Python 3.8+)
+    return (single_byte_newline and MAX_WORKERS > 1 and multiprocessing.current_process().name == 'MainProcess'
+            and os.path.getsize(fpath) >= PARALLEL_MIN_FILE_BYTES)
+
+def read_rows_parallel(fpath:str, encoding:str, delimiter:str, used_headers:list):
+    '''returns iterator of used_headers values of each data row (tuples, in file order; None for missing values as
+    csv.DictReader), parsing newline aligned byte ranges of file in process pool. Returns None if file must be read
+    sequentially: any record spans several lines (quoted field with embedded newline, also split by chunk boundary)
+    or pool failed (e.g. workers could not be started)'''
+    header_end, fieldnames = _read_header(fpath, encoding, delimiter)
+    # same column as csv.DictReader for duplicate headers: last one
+    header_idx = {header : idx for idx, header in enumerate(fieldnames)}
+    used_indices = [header_idx[header] for header in used_headers]
+    byte_ranges = _get_byte_ranges(fpath, header_end)
+    workers = min(len(byte_ranges), MAX_WORKERS)
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(_parse_chunk, fpath, start, end, encoding, delimiter, used_indices) for start, end in byte_ranges]
+            chunks = [future.result() for future in futures]
+    except (BrokenProcessPool, OSError) as e:
+        logging.warning(f'Parallel parsing of {os.path.basename(fpath)} failed, reading sequentially. Err: {e}')
+        return None
+    if any(is_multiline for _, is_multiline in chunks):
+        logging.info(f'Records spanning several lines found in {os.path.basename(fpath)}. Parallel parsing results discarded')
+        return None
+    logging.info(f'Parsed {os.path.basename(fpath)} in {len(byte_ranges)} chunks using {workers} worker processes')
+    return _iter_chunks_rows(chunks)
+
+def _iter_chunks_rows(chunks:list):
+    '''generator yielding rows of parsed chunks in file order, releasing each chunk once its rows are yielded'''
+    chunks.reverse()
+    while chunks:
+        rows, _ = chunks.pop()
+        yield from rows
+
+def _read_header(fpath:str, encoding:str, delimiter:str) -> tuple:
+    '''returns byte offset of first data row and parsed header fieldnames'''
+    with open(fpath, 'rb') as f:
+        header_line = f.readline()
+    text = io.StringIO(header_line.decode(encoding), newline=None)
+    fieldnames = next(csv.reader(text, delimiter=delimiter), [])
+    return len(header_line), fieldnames
+
+def _get_byte_ranges(fpath:str, data_start:int) -> list:
+    '''returns list of (start, end) byte offsets of ~CHUNK_BYTES file chunks, each ending after newline'''
+    file_size = os.path.getsize(fpath)
+    byte_ranges = []
+    with open(fpath, 'rb') as f:
+        start = data_start
+        while start < file_size:
+            f.seek(min(start + CHUNK_BYTES, file_size))
+            f.readline()
+            end = min(f.tell(), file_size)
+            byte_ranges.append((start, end))
+            start = end
+    return byte_ranges
+
+def _parse_chunk(fpath:str, start:int, end:int, encoding:str, delimiter:str, used_indices:list) -> tuple:
+    '''worker: returns used_indices values tuples of rows in byte range, True if any record spans several physical lines.
+    Strict reader raises on chunk ending inside quoted field: embedded newline falling on chunk boundary'''
+    with open(fpath, 'rb') as f:
+        f.seek(start)
+        chunk = f.read(end - start)
+    reader = csv.reader(io.StringIO(chunk.decode(encoding), newline=None), delimiter=delimiter, strict=True)
+    rows, records_count = [], 0
+    try:
+        for row in reader:
+            records_count += 1
+            # blank lines are skipped as in csv.DictReader
+            if row:
+                row_len = len(row)
+                rows.append(tuple(row[idx] if idx < row_len else None for idx in used_indices))
+    except csv.Error:
+        return [], True
+    return rows, reader.line_num != records_count
+
+
+if __name__ == "__main__":
+    pass
@@ -2,13 +2,15 @@ import logging
 import os
 from datetime import datetime
 from collections import defaultdict
-from accounting_utils import get_output_dir, get_EU_countries_from_txt, get_order_tax
-from reports import COMReport, EUReport
-from constants import VBA_ERROR_ALERT, VBA_KEYERROR_ALERT, VBA_NO_NEW_JOB
+from accounting_utils import get_output_dir, get_EU_countries_from_txt, delete_file
+from regions import RegionClassifier, EU_SEGMENT, NON_EU_SEGMENT
+from constants import VBA_ERROR_ALERT, VBA_NO_NEW_JOB
 
 
 # GLOBAL VARIABLES
 EU_COUNTRIES_TXT = 'EU Countries.txt'
+# EU countries txt file (path, modification time) : countries list. Kept warm between jobs in resident job server
+_EU_COUNTRIES_CACHE = {}
 
 
 class ParseOrders():
@@ -20,7 +22,7 @@ class ParseOrders():
     when testing flag = True, export is suspended, but orders passed to class are still added to database
     
     Args:
-    - orders : list - list of order dictionaries
+    - orders : list - list of OrderRecord objects
     - sales_channel : str - 'AmazonEU'/'AmazonCOM'/'Amazon Warehouse' to differenciate different report
     - db_client:object - db client to iteract with during program runtime'''
     
@@ -33,41 +35,52 @@ class ParseOrders():
         self.non_eu_orders = []
     
     def _prepare_filepaths(self):
-        '''creates cls variables of files abs paths to be created one dir above this script dir'''
+        '''creates cls variable of report abs path one dir above this script dir, reserving it by creating empty file
+        exclusively: several reports of same channel within a minute (batch mode workers) get distinct numbered names'''
         output_dir = get_output_dir()
         date_stamp = datetime.today().strftime("%Y.%m.%d %H.%M")
-        self.report_path = os.path.join(output_dir, f'{self.sales_channel} Report {date_stamp}.xlsx')
+        report_name = f'{self.sales_channel} Report {date_stamp}'
+        report_no = 1
+        while True:
+            self.report_path = os.path.join(output_dir, f'{report_name}.xlsx' if report_no == 1 else f'{report_name} ({report_no}).xlsx')
+            try:
+                with open(self.report_path, 'x'):
+                    return
+            except FileExistsError:
+                report_no += 1
     
     def split_orders_by_region(self):
-        '''Sorts all orders into eu/non_eu regions based ship country and sales channel'''
+        '''Sorts all orders into eu/non_eu regions based ship country and sales channel (see regions.RegionClassifier)'''
         self.eu_countries = self._get_EU_countries_list_from_file()
+        self._parse_orders_numbers()
+        segments = RegionClassifier(self.eu_countries, self.sales_channel).split_by_segment(self.all_orders)
+        self.eu_orders = segments[EU_SEGMENT]
+        self.non_eu_orders = segments[NON_EU_SEGMENT]
+    
+    def _parse_orders_numbers(self):
+        '''converts prices and taxes of new orders to floats (region rules, reports)'''
         for order in self.all_orders:
             try:
-                if order[self.proxy_keys['ship-country']] in self.eu_countries:
-                    # Add EU orders with tax = 0 to non-vat (non-eu)
-                    if self.sales_channel == 'AmazonEU' and get_order_tax(order, self.proxy_keys) == 0:
-                        self.non_eu_orders.append(order)
-                    else:
-                        self.eu_orders.append(order)
-                else:
-                    self.non_eu_orders.append(order)
-            except KeyError:
-                logging.exception(f'Could not find item-tax in (using proxy keys) order keys. Order: {order}\nClosing connection to database, alerting VBA, exiting...')
-                self.db_client.close_connection()
-                print(VBA_KEYERROR_ALERT)
-                exit()
-            except ValueError:
-                logging.exception(f'Could not return float value for item-tax (using proxy keys) in order: {order}\nClosing connection to database, alerting VBA, exiting...')
+                order.parse_numbers()
+            except (ValueError, TypeError):
+                logging.exception(f'Could not return float value for price or tax in order: {order}\nClosing connection to database, alerting VBA, exiting...')
                 self.db_client.close_connection()
                 print(VBA_ERROR_ALERT)
                 exit()
-    
+
     def _get_EU_countries_list_from_file(self):
-        '''returns list of EU member countries from TXT file'''
+        '''returns list of EU member countries from TXT file, read once per file modification'''
         current_dir = get_output_dir(client_file=False)
         txt_abspath = os.path.join(current_dir, EU_COUNTRIES_TXT)
         logging.debug(f'Trying to access EU countries txt file: {txt_abspath}')
-        return get_EU_countries_from_txt(txt_abspath)
+        try:
+            cache_key = (txt_abspath, os.path.getmtime(txt_abspath))
+        except OSError:
+            return get_EU_countries_from_txt(txt_abspath)
+        if cache_key not in _EU_COUNTRIES_CACHE:
+            _EU_COUNTRIES_CACHE.clear()
+            _EU_COUNTRIES_CACHE[cache_key] = get_EU_countries_from_txt(txt_abspath)
+        return _EU_COUNTRIES_CACHE[cache_key]
 
     def exit_no_new_orders(self):
         '''terminate if all lists after sorting are empty'''
@@ -92,7 +105,7 @@ class ParseOrders():
                                 }'''
         eu_currency_grouped = self.get_region_currency_based_dict(self.eu_orders)
         non_eu_currency_grouped = self.get_region_currency_based_dict(self.non_eu_orders)
-        self.export_obj = {'EU' : eu_currency_grouped, 'NON-EU' : non_eu_currency_grouped}
+        self.export_obj = {EU_SEGMENT : eu_currency_grouped, NON_EU_SEGMENT : non_eu_currency_grouped}
         logging.debug(f'Returning export object with keys: {self.export_obj.keys()}')
         return self.export_obj
 
@@ -101,13 +114,17 @@ class ParseOrders():
         Example: {'EUR': [order1, order2...], 'USD':[order1, order2...], ...}'''
         currency_based_dict = defaultdict(list)
         for order in region_orders:
-            order_currency = order[self.proxy_keys['currency']].upper()
+            order_currency = order.currency.upper()
             currency_based_dict[order_currency].append(order)
         return currency_based_dict
 
     def export_report(self):
-        '''creates EUReport or COMReport instance, and exports report in xlsx format'''
+        '''creates EUReport or COMReport instance, and exports report in xlsx format.
+        reports (openpyxl) are imported here: costly import, not needed when terminating on no new orders'''
+        self.report_path = None
         try:
+            self._prepare_filepaths()
+            from reports import COMReport, EUReport
             if self.sales_channel in ['AmazonEU', 'Amazon Warehouse']:
                 logging.info(f'Passing orders to create report with {EUReport.__name__} class')
                 EUReport(self.export_obj, self.eu_countries, self.sales_channel, self.proxy_keys).export(self.report_path)
@@ -117,6 +134,8 @@ class ParseOrders():
             logging.info(f'XLSX report {os.path.basename(self.report_path)} successfully created.')
         except:
             logging.exception(f'Unexpected error creating report. Closing database connection, alerting VBA, exiting ParseOrders...')
+            if self.report_path:
+                delete_file(self.report_path)
             self.db_client.close_connection()
             print(VBA_ERROR_ALERT)
             exit()
@@ -128,7 +147,6 @@ class ParseOrders():
 
     def export_orders(self, testing=False):
         '''Summing up tasks inside ParseOrders class'''
-        self._prepare_filepaths()
         self.split_orders_by_region()
         self.exit_no_new_orders()
         self.prepare_export_obj()
@@ -0,0 +1,77 @@
+# GLOBAL VARIABLES
+# sales channel : region rules. Channels missing here are classified by EU membership only
+# zero_tax_non_eu - orders with (rounded) zero item tax are attributed to 'non_eu' region
+# zero_tax_non_eu_segment - zero tax rule also moves EU orders to NON-EU segment (sheets), not only summary region
+# country_regions - country specific regions (add 2023-04), take precedence over EU membership
+CHANNEL_RULES = {
+    'AmazonEU' : {'zero_tax_non_eu' : True, 'zero_tax_non_eu_segment' : True, 'country_regions' : True},
+    'Amazon Warehouse' : {'zero_tax_non_eu' : True, 'zero_tax_non_eu_segment' : False, 'country_regions' : True},
+}
+COUNTRY_REGIONS = {'GB' : 'gb'}
+# country : {postcode prefix : region}, checked before COUNTRY_REGIONS
+POSTCODE_PREFIX_REGIONS = {'GB' : {'BT' : 'n.ireland'}}
+EU_SEGMENT = 'EU'
+NON_EU_SEGMENT = 'NON-EU'
+
+
+class RegionClassifier():
+    '''Region rules engine shared by ParseOrders, EUReport and COMReport. EU countries list and sales channel rules
+    (CHANNEL_RULES, COUNTRY_REGIONS, POSTCODE_PREFIX_REGIONS) are compiled to hashed lookup tables on init. Main methods:
+
+    classify(orders) - stores region in order.region: 'eu', 'non_eu', 'gb' or 'n.ireland'.
+    Orders already classified are skipped, so each order is classified once whichever caller comes first.
+
+    split_by_segment(orders) - classifies orders, returns dict of segment (sheets) : orders list ('EU', 'NON-EU')
+
+    Arguments:
+
+    eu_countries - list of EU member countries as ['EE', 'LV', 'LT', 'FI', ...]
+
+    sales_channel - 'AmazonEU' / 'AmazonCOM' / 'Amazon Warehouse' selecting CHANNEL_RULES'''
+
+    def __init__(self, eu_countries: list, sales_channel: str):
+        rules = CHANNEL_RULES.get(sales_channel, {})
+        self.zero_tax_non_eu = rules.get('zero_tax_non_eu', False)
+        self.zero_tax_non_eu_segment = rules.get('zero_tax_non_eu_segment', False)
+        self.eu_countries = frozenset(eu_countries)
+        self.country_regions = {country : 'eu' for country in self.eu_countries}
+        self.postcode_prefix_regions = {}
+        if rules.get('country_regions', False):
+            self.country_regions.update(COUNTRY_REGIONS)
+            for country, prefix_regions in POSTCODE_PREFIX_REGIONS.items():
+                prefix_lengths = sorted({len(prefix) for prefix in prefix_regions}, reverse=True)
+                self.postcode_prefix_regions[country] = (prefix_lengths, prefix_regions)
+
+    def classify(self, orders) -> None:
+        '''stores region in order.region for each not yet classified order of orders iterable'''
+        for order in orders:
+            if order.region is None:
+                order.region = self._get_region(order)
+
+    def _get_region(self, order: object) -> str:
+        if self.zero_tax_non_eu and round(order.item_tax, 2) == 0:
+            return 'non_eu'
+        country = order.ship_country
+        if country in self.postcode_prefix_regions:
+            prefix_lengths, prefix_regions = self.postcode_prefix_regions[country]
+            for prefix_length in prefix_lengths:
+                region = prefix_regions.get(order.ship_postal_code[:prefix_length])
+                if region:
+                    return region
+        return self.country_regions.get(country, 'non_eu')
+
+    def split_by_segment(self, orders: list) -> dict:
+        '''classifies orders, returns {'EU' : [order1, ...], 'NON-EU' : [order2, ...]} keeping orders sequence.
+        EU segment: ship country is EU member, unless zero tax rule moves order to NON-EU (zero_tax_non_eu_segment)'''
+        self.classify(orders)
+        segments = {EU_SEGMENT : [], NON_EU_SEGMENT : []}
+        for order in orders:
+            if order.region == 'eu' or (not self.zero_tax_non_eu_segment and order.ship_country in self.eu_countries):
+                segments[EU_SEGMENT].append(order)
+            else:
+                segments[NON_EU_SEGMENT].append(order)
+        return segments
+
+
+if __name__ == "__main__":
+    pass
@@ -1,19 +1,26 @@
-import copy
 from collections import defaultdict
 import openpyxl
 from constants import TEMPLATE_SHEET_MAPPING, COM_SUMMARY_HEADERS
-from accounting_utils import simplify_date, col_to_letter, get_last_used_row_col, sum_formula_total
+from accounting_utils import col_to_letter, sum_formula_total
+from order_record import get_fields_getter
+from regions import RegionClassifier
+from .summary_cube import SummaryCube
+from .sheet_plan import plan_segment_sheets, check_summary_rows
+from .report_writers import get_report_writer, DEFAULT_WRITER_BACKEND, DEFAULT_COMPRESSION_LEVEL
+from .summary_styles import StyleRegistry
 
 
 # GLOBAL VARIABLES
 SUMMARY_SHEET_NAME = 'Summary'
 TABLE_NAME = 'Daily Breakdown'
-BOLD_STYLE = openpyxl.styles.Font(bold=True, name='Calibri')
-BACKGROUND_COLOR_STYLE = openpyxl.styles.PatternFill(fgColor='D6DEFF',fill_type='solid')
-THIN_BORDER = openpyxl.styles.Side(border_style='thin')
 SHEET_HEADERS = list(TEMPLATE_SHEET_MAPPING.keys())
+SHEET_PROXY_KEYS = list(TEMPLATE_SHEET_MAPPING.values())
 REPORT_START_ROW = 1
 REPORT_START_COL = 1
+SUMMARY_LAST_COL = REPORT_START_COL + len(COM_SUMMARY_HEADERS) - 1
+# daily breakdown date row columns formatting (see _fill_format_date_data)
+DATE_ROW_BOLD_COLS = [REPORT_START_COL + offset for offset in (2, 3)]
+DATE_ROW_NUMBER_COLS = [REPORT_START_COL + offset for offset in (2, 4, 6)]
 
 
 class COMReport():
@@ -35,17 +42,12 @@ class COMReport():
     
     def __init__(self, export_obj: dict, eu_countries: list, sales_channel: str, proxy_keys: dict):
         self.eu_countries = eu_countries
+        self.region_classifier = RegionClassifier(eu_countries, sales_channel)
         self.sales_channel = sales_channel
         self.proxy_keys = proxy_keys
-        self.export_obj = self._clean_incoming_data(export_obj)
+        self.export_obj = export_obj
         self._get_report_objs()
 
-    def _clean_incoming_data(self, export_obj:dict) -> dict:
-        '''returns cleaned data in same structure as class input obj'''
-        for region, currency in self._unpack_export_obj(export_obj):
-            export_obj[region][currency] = self._correct_orders_numbers_dates(export_obj[region][currency])
-        return export_obj
-
     @staticmethod
     def _unpack_export_obj(export_obj:dict):
         '''generator yielding self.export_obj dict KEY1 (region) and nested KEY2 (currency) at a time'''
@@ -53,26 +55,17 @@ class COMReport():
             for currency in export_obj[region]:
                 yield region, currency    
     
-    def _correct_orders_numbers_dates(self, orders: list) -> list:
-        '''date and numbers data cleaning for report:
-        - original date format (2020-04-16T10:07:16+00:00) simplified to YYYY-MM-DD
-        - all numbers of interest converted to floats'''
-        for order in orders:
-            # Simplifying order dates:
-            order[self.proxy_keys['purchase-date']] = simplify_date(order[self.proxy_keys['purchase-date']], self.sales_channel)
-            order[self.proxy_keys['payments-date']] = simplify_date(order[self.proxy_keys['payments-date']], self.sales_channel)
-            # Converting numbers stored as strings to floats:
-            order[self.proxy_keys['item-price']] = float(order[self.proxy_keys['item-price']])
-            order[self.proxy_keys['item-tax']] = float(order[self.proxy_keys['item-tax']])
-            order[self.proxy_keys['shipping-price']] = float(order[self.proxy_keys['shipping-price']])
-            order[self.proxy_keys['shipping-tax']] = float(order[self.proxy_keys['shipping-tax']])
-        return orders
-
     def _get_report_objs(self):
         '''prepares cls variables for excel report workbook filling'''
         self.segments_orders_obj = self._get_segments_orders_obj(self.export_obj)
         self.summary_table_obj = self._get_summary_table_obj(self.export_obj)
-        self.summary_taxes_obj = self._get_summary_taxes_obj()
+        self.summary_cube = self._get_summary_cube(self.summary_table_obj)
+        self.sheets_plan = plan_segment_sheets(self.segments_orders_obj)
+        check_summary_rows(self._get_summary_rows_count())
+
+    def _get_summary_rows_count(self) -> int:
+        '''returns summary sheet rows count: headers, date row for each currency date and sum row below each currency'''
+        return REPORT_START_ROW + 1 + sum(len(date_objs) + 1 for date_objs in self.summary_table_obj.values())
 
     def _get_segments_orders_obj(self, export_obj:dict) -> dict:
         '''returns dict of dicts for each segment (sheets) and corresponding list of orders (written to separate sheets)
@@ -87,73 +80,36 @@ class COMReport():
         {'EUR':{'date1':[order1, order2...], 'date2':[order3, order4...], ...},
         'GBP':{'date1':[order1, order2...], 'date2':[order1, order2...], ...}, ...}
 
+        Formed in single pass over export_obj, date lists reference same order objects (no order lists are copied)
         NOTE: output is region agnostic. Regions get mixed up'''
-        summary_table_obj = defaultdict(dict)
-        currency_based = defaultdict(list)
-        # 1st loop forms currency (key) based obj. Output: {'currency1':[order1, order2, ...], 'currency2':[order2, order3...],...}
+        summary_table_obj = defaultdict(lambda: defaultdict(list))
         for region, currency in self._unpack_export_obj(export_obj):
-            currency_based[currency] = currency_based[currency] + export_obj[region][currency]
-        # 2nd loop - forms {'currency':{'date1':[order1, order2, ...], 'date2':[order1, order2, ...], ...}, 'currency2':{...}}
-        for currency in currency_based:
-            summary_table_obj[currency] = self._get_payment_date_obj(currency_based[currency])
+            for order in export_obj[region][currency]:
+                summary_table_obj[currency][order.payments_date].append(order)
         return summary_table_obj
 
-    def _get_payment_date_obj(self, orders: list) -> dict:
-        '''forms a dictionary based on dates in list of order dicts. Returns payment dates as keys and orders list as values.
-        Output format: {{'YYYY-MM-D1':[order1, order2, ...]},
-                        {'YYYY-MM-D2':[order1, order2, ...]}, ...}'''
-        payment_date_orders = defaultdict(list)
-        for order in orders:
-            payment_date_orders[order[self.proxy_keys['payments-date']]].append(order)
-        return payment_date_orders
-
-    def _get_summary_taxes_obj(self):
-        '''Returns currency and date based calculated taxes for UK orders (item-tax + shipping)
-        
-        self.summary_table_obj:
-        {'EUR':{'date1':[order1, order2...], 'date2':[order3, order4...], ...},
-        'GBP':{'date1':[order1, order2...], 'date2':[order1, order2...], ...}, ...}
-
-        function returns:
-        {'EUR':{'date1':calculated_taxes1, 'date2':calculated_taxes2, ...},
-        'GBP':{'date1':calculated_taxes3, 'date2':calculated_taxes4, ...}, ...}'''
-        taxes_obj = copy.deepcopy(self.summary_table_obj)
-        for currency, date_orders_dict in self.summary_table_obj.items():
-            for date, date_orders in date_orders_dict.items():
-                taxes_obj[currency][date] = self._calc_orders_taxes(date_orders)
-        return taxes_obj
-
-    def _calc_orders_taxes(self, orders:list) -> float:
-        '''returns sum of (item-tax + shipping-tax) for each order inside orders list'''
-        taxes = 0
-        for order in orders:
-            taxes += order[self.proxy_keys['item-tax']]
-            taxes += order[self.proxy_keys['shipping-tax']]
-        return round(taxes, 2)
+    def _get_summary_cube(self, summary_table_obj: dict) -> SummaryCube:
+        '''aggregates orders of summary_table_obj to (currency, date, region, country) cube in single pass.
+        Orders not classified by ParseOrders yet are classified here (see regions.RegionClassifier)'''
+        summary_cube = SummaryCube()
+        for currency, date_objs in summary_table_obj.items():
+            for date, date_orders in date_objs.items():
+                self.region_classifier.classify(date_orders)
+                for order in date_orders:
+                    summary_cube.add_order(currency, date, order.region, order.ship_country,
+                                        order.item_price + order.shipping_price, order.item_tax, order.shipping_tax)
+        return summary_cube
 
     def _data_to_sheet(self, ws_name: str, orders_data: list):
-        '''creates new ws_name sheet and fills it with orders_data argument data'''
-        self._create_sheet(ws_name)
-        active_ws = self.wb[ws_name]
-        active_ws.freeze_panes = active_ws['A2']
-        self._fill_sheet(active_ws, orders_data)
-        self._adjust_col_widths(active_ws, self.col_widths)
-
-    def _create_sheet(self, ws_name: str):
-        '''creates new sheet obj with name ws_name'''
-        self.wb.create_sheet(title=ws_name)
+        '''streams orders_data argument data to ws_name segment sheet through report writer.
+        Column widths are resized before any rows (streamed sheets require widths first)'''
         self.col_widths = {}
-
-    def _fill_sheet(self, active_ws, orders_data:list):
-        '''writes headers, and corresponding orders data to active_ws, resizes columns'''
-        self._write_headers(active_ws)
-        self._write_sheet_orders(active_ws, orders_data)
-
-    def _write_headers(self, ws: object):
-        '''writes header row to segment sheet'''
         for col, header in enumerate(SHEET_HEADERS):
             self._update_col_widths(col, header)
-            ws.cell(1, col + 1).value = header
+        self._update_data_col_widths(orders_data)
+        get_row_values = get_fields_getter(SHEET_PROXY_KEYS)
+        self.writer.write_data_sheet(ws_name, SHEET_HEADERS, map(get_row_values, orders_data),
+                                    self._get_adjusted_col_widths(self.col_widths), freeze_panes='A2')
 
     def _update_col_widths(self, col: int, cell_value: str, zero_indexed=True):
         '''runs on each cell. Forms a dictionary {'A':30, 'B':15...} for max column widths in worksheet (width as length of max cell)'''
@@ -165,38 +121,36 @@ class COMReport():
         else:
             self.col_widths[col_letter] = len(cell_value)
 
-    def _write_sheet_orders(self, ws, orders_data: list):
-        '''writes orders_data to segment sheet'''
-        for row, col in self.range_generator(orders_data, SHEET_HEADERS):
-            order_dict = orders_data[row]
-
-            proxy_key = TEMPLATE_SHEET_MAPPING[SHEET_HEADERS[col]]
-            # proxy value = order key
-            proxy_value = self.proxy_keys[proxy_key]
-
-            self._update_col_widths(col, str(order_dict[proxy_value]))
-            # offsets due to excel vs python numbering  + headers in row 1
-            ws.cell(row + 2, col + 1).value = order_dict[proxy_value]
-
-    @staticmethod
-    def range_generator(orders_data, headers):
-        for row, _ in enumerate(orders_data):
-            for col, _ in enumerate(headers):
-                yield row, col
+    def _update_data_col_widths(self, orders_data: list):
+        '''updates self.col_widths with longest value of each segment sheet column'''
+        for col, proxy_key in enumerate(SHEET_PROXY_KEYS):
+            get_value = get_fields_getter([proxy_key])
+            longest_value = max((len(str(get_value(order))) for order in orders_data), default=0)
+            col_letter = col_to_letter(col)
+            self.col_widths[col_letter] = max(self.col_widths.get(col_letter, 0), longest_value)
 
     def _adjust_col_widths(self, ws, col_widths: dict, summary=False):
         '''iterates over {'A':30, 'B':40, 'C':35...} dict to resize worksheets' column widths. Summary ws wider columns with summary=True'''
-        factor = 1.3 if summary else 1.05
-        for col_letter in col_widths:
-            adjusted_width = ((col_widths[col_letter] + 2) * factor)
+        for col_letter, adjusted_width in self._get_adjusted_col_widths(col_widths, summary).items():
             ws.column_dimensions[col_letter].width = adjusted_width
+
+    @staticmethod
+    def _get_adjusted_col_widths(col_widths: dict, summary=False) -> dict:
+        '''returns {'A':33.6, 'B':44.1...} worksheet column widths for {'A':30, 'B':40...} longest cell lengths'''
+        factor = 1.3 if summary else 1.05
+        return {col_letter : (width + 2) * factor for col_letter, width in col_widths.items()}
     
     def fill_format_summary(self):
         '''Forms a summary sheet report unpacks self.summary_table_obj to dynamic height table,
         change insert point of table with:
         REPORT_START_ROW, REPORT_START_COL'''
-        self.s_ws = self.wb[SUMMARY_SHEET_NAME]
+        # summary is formed in memory, streamed to write-only workbook on export
+        self.s_ws = openpyxl.Workbook().active
+        self.styles = StyleRegistry(self.s_ws)
         self.col_widths = {}   
+        # summary layout model: daily breakdown (2nd row) headers by column and last used column
+        self.summary_headers = {}
+        self.summary_last_col = 0
         self.row_cursor = REPORT_START_ROW
         self._add_summary_headers()
         self._color_table_headers()
@@ -206,12 +160,12 @@ class COMReport():
             
             self._apply_horizontal_line(self.row_cursor)
             self.s_ws.cell(self.row_cursor, REPORT_START_COL).value = currency
-            self.s_ws.cell(self.row_cursor, REPORT_START_COL).font = BOLD_STYLE
+            self.styles.apply(self.row_cursor, REPORT_START_COL, 'bold')
             # Writing data to rest of columns:
-            for date, date_orders in date_objs.items():
+            for date in date_objs:
                 self.s_ws.cell(self.row_cursor, REPORT_START_COL + 1).value = date
-                self._fill_format_date_data(date_orders)
-                taxes = self.summary_taxes_obj[currency][date]
+                self._fill_format_date_data(currency, date)
+                taxes = self.summary_cube.taxes(currency, date)
                 self.s_ws.cell(self.row_cursor, REPORT_START_COL + 9).value = taxes
                 self.row_cursor += 1
 
@@ -223,36 +177,36 @@ class COMReport():
     def _add_summary_headers(self):
         '''writes fixed headers in summary sheet, freeze pane'''
         self.s_ws.cell(self.row_cursor, REPORT_START_COL + 4).value = TABLE_NAME
-        self.s_ws.cell(self.row_cursor, REPORT_START_COL + 4).font = BOLD_STYLE
+        self.styles.apply(self.row_cursor, REPORT_START_COL + 4, 'bold')
         self.s_ws.freeze_panes = self.s_ws[f'A{REPORT_START_ROW + 2}']
         self.row_cursor += 1
         for idx, header in enumerate(COM_SUMMARY_HEADERS):
             self.s_ws.cell(self.row_cursor, REPORT_START_COL + idx).value = header
             self._update_col_widths(REPORT_START_COL + idx, header, zero_indexed=False)
-            self.s_ws.cell(self.row_cursor, REPORT_START_COL + idx).font = BOLD_STYLE
+            self._track_summary_header(REPORT_START_COL + idx, header)
+        self.styles.apply_row(self.row_cursor, REPORT_START_COL, SUMMARY_LAST_COL, 'bold')
         self.row_cursor += 1
 
+    def _track_summary_header(self, col: int, header: str):
+        '''records daily breakdown header in summary layout model, updates last used summary column'''
+        self.summary_headers[col] = header
+        self.summary_last_col = max(self.summary_last_col, col)
+
     def _add_sum_row_below_currency_segment(self):
         '''adds SUM row below currency segment and inserts vertical sums (sum across row dates)
         segment in rows: {self.ccy_segment_start_row}:{self.row_cursor-1}'''
-        self.s_ws.cell(self.row_cursor, REPORT_START_COL).font = BOLD_STYLE
-        self.s_ws.cell(self.row_cursor, REPORT_START_COL).fill = BACKGROUND_COLOR_STYLE
         self.s_ws.cell(self.row_cursor, REPORT_START_COL + 1).value = 'SUM'
-        self.s_ws.cell(self.row_cursor, REPORT_START_COL + 1).font = BOLD_STYLE
-        self.s_ws.cell(self.row_cursor, REPORT_START_COL + 1).fill = BACKGROUND_COLOR_STYLE
-
-        current_limits = get_last_used_row_col(self.s_ws)
-        curr_last_col = current_limits['max_col']
+        self.styles.apply_row(self.row_cursor, REPORT_START_COL, REPORT_START_COL + 1, 'bold')
+        self.styles.apply_row(self.row_cursor, REPORT_START_COL, self.summary_last_col, 'background')
 
-        for c in range(REPORT_START_COL + 2, curr_last_col + 1):
-            header = self.s_ws.cell(REPORT_START_ROW + 1, c).value
+        for c in range(REPORT_START_COL + 2, self.summary_last_col + 1):
+            header = self.summary_headers[c]
             if bool(header):
                 self.s_ws.cell(self.row_cursor, c).value = sum_formula_total(c, self.ccy_segment_start_row, self.row_cursor-1)
 
             # if column name (row 2) does not contain '#', format as number
             if not '#' in header:
-                self.s_ws.cell(self.row_cursor, c).number_format = '#,##0.00'
-            self.s_ws.cell(self.row_cursor, c).fill = BACKGROUND_COLOR_STYLE
+                self.styles.apply(self.row_cursor, c, 'number')
         self.row_cursor += 1
 
     def _get_ccy_segment_total(self, c: int):
@@ -267,83 +221,42 @@ class COMReport():
         return round(total, 2)
 
     def _color_table_headers(self):
-        '''Colors range defined in generator in summary sheet'''
-        for row, col in self._header_cells_generator():
-            self.s_ws.cell(row, col).fill = BACKGROUND_COLOR_STYLE
-
-    @staticmethod
-    def _header_cells_generator():
-        '''generator for daily breakdown headers coloring, yields row, col'''
-        for row in [REPORT_START_ROW, REPORT_START_ROW + 1]:
-            for col in range(REPORT_START_COL, len(COM_SUMMARY_HEADERS) + REPORT_START_COL):
-                yield row, col
+        '''Colors daily breakdown headers (2 rows) in summary sheet'''
+        self.styles.apply_range(REPORT_START_ROW, REPORT_START_ROW + 1, REPORT_START_COL, SUMMARY_LAST_COL, 'background')
 
     def _apply_horizontal_line(self, row:int):
         '''adds horizonal line through A:J (c=1 case) in summary sheet at argument row top'''
-        for col in range(REPORT_START_COL, len(COM_SUMMARY_HEADERS) + REPORT_START_COL):
-            self.s_ws.cell(row, col).border = openpyxl.styles.Border(top=THIN_BORDER) 
+        self.styles.apply_row(row, REPORT_START_COL, SUMMARY_LAST_COL, 'top_line')
 
-    def _fill_format_date_data(self, date_orders:list):
-        '''calculates neccessary data and fills, formats data in summary sheet in single row'''
+    def _fill_format_date_data(self, currency: str, date: str):
+        '''fills, formats summary cube data of currency and date in summary sheet in single row'''
         # Data does not update column widths, only headers. If data formats, scope were to change, function shall be updated 
-        self.s_ws.cell(self.row_cursor, REPORT_START_COL + 2).value = self._get_segment_total(date_orders)
-        self.s_ws.cell(self.row_cursor, REPORT_START_COL + 2).font = BOLD_STYLE
-        self.s_ws.cell(self.row_cursor, REPORT_START_COL + 2).number_format = '#,##0.00'
-        self.s_ws.cell(self.row_cursor, REPORT_START_COL + 3).value = len(date_orders)
-        self.s_ws.cell(self.row_cursor, REPORT_START_COL + 3).font = BOLD_STYLE
-        # Separating regions, filling data:
-        eu_orders, non_eu_orders = self._split_by_region(date_orders)
-        self.s_ws.cell(self.row_cursor, REPORT_START_COL + 4).value = self._get_segment_total(eu_orders)
-        self.s_ws.cell(self.row_cursor, REPORT_START_COL + 4).number_format = '#,##0.00'
-        self.s_ws.cell(self.row_cursor, REPORT_START_COL + 5).value = len(eu_orders)
-
-        self.s_ws.cell(self.row_cursor, REPORT_START_COL + 6).value = self._get_segment_total(non_eu_orders)
-        self.s_ws.cell(self.row_cursor, REPORT_START_COL + 6).number_format = '#,##0.00'
-        self.s_ws.cell(self.row_cursor, REPORT_START_COL + 7).value = len(non_eu_orders)
-
-    def _split_by_region(self, orders: list):
-        '''splits provided list of orders into two lists based on order['ship-country'] (using proxy keys) EU membership:
-        1. eu orders
-        2. non-eu orders'''    
-        eu_orders, non_eu_orders = [], []
-        for order in orders:
-            if order[self.proxy_keys['ship-country']] in self.eu_countries:
-                eu_orders.append(order)
-            else:
-                non_eu_orders.append(order)
-        return eu_orders, non_eu_orders
-
-    def _get_segment_total(self, orders: list) -> float:
-        '''Returns a sum of all orders' item-price + shipping-price in list of order dicts'''
-        total = 0
-        for order in orders:
-            total += order[self.proxy_keys['item-price']] + order[self.proxy_keys['shipping-price']]
-        return round(total, 2)
+        cube = self.summary_cube
+        self.s_ws.cell(self.row_cursor, REPORT_START_COL + 2).value = cube.total(currency, date)
+        self.s_ws.cell(self.row_cursor, REPORT_START_COL + 3).value = cube.count(currency, date)
+        # Filling separate regions data:
+        self.s_ws.cell(self.row_cursor, REPORT_START_COL + 4).value = cube.total(currency, date, 'eu')
+        self.s_ws.cell(self.row_cursor, REPORT_START_COL + 5).value = cube.count(currency, date, 'eu')
+
+        self.s_ws.cell(self.row_cursor, REPORT_START_COL + 6).value = cube.total(currency, date, 'non_eu')
+        self.s_ws.cell(self.row_cursor, REPORT_START_COL + 7).value = cube.count(currency, date, 'non_eu')
+
+        self.styles.apply_cols(self.row_cursor, DATE_ROW_BOLD_COLS, 'bold')
+        self.styles.apply_cols(self.row_cursor, DATE_ROW_NUMBER_COLS, 'number')
 
-    def _fill_summary_country_columns(self, eu_orders: list):
+    def _fill_summary_country_columns(self, currency: str, date: str):
         '''fills individual eu countries data to separate columns'''
-        countries_orders = self._get_country_based_dict(eu_orders)
         # Iterate countries, identify target/new column
-        for country, country_orders in countries_orders.items():
+        for country in self.summary_cube.region_countries(currency, date, 'eu'):
             if country in self.eu_countries_header_cols.keys():
                 ref_col = self.eu_countries_header_cols[country]
             else:
-                last_used_row_col = get_last_used_row_col(self.s_ws)
-                ref_col = last_used_row_col['max_col'] + 1
+                ref_col = self.summary_last_col + 1
                 # Enter data for existing self.row_cursor and new_col
                 self._enter_new_country_header(country, ref_col)  
 
             # Add corresponding data in added/existing ref_col
-            self._enter_format_country_date_data(country_orders, country, ref_col)
-
-    def _get_country_based_dict(self, orders: list) -> dict:
-        '''Splits list of orders to country based dict
-        Returns:    {'DE': [order1, order2, ...], 'IT': [order1, order2, ...], ...}'''
-        country_based_dict = defaultdict(list)
-        for order in orders:
-            country_code = order[self.proxy_keys['ship-country']]
-            country_based_dict[country_code].append(order)
-        return country_based_dict
+            self._enter_format_country_date_data(currency, date, country, ref_col)
     
     def _enter_new_country_header(self, country: str, ref_col: int):
         '''enter new country header col values, adjust col widths'''
@@ -359,27 +272,28 @@ class COMReport():
         '''enters header value, bolds it, updates col widths dict'''
         self.s_ws.cell(row, col).value = header
         self._update_col_widths(col, header, zero_indexed=False)
-        self.s_ws.cell(row, col).font = BOLD_STYLE
+        self.styles.apply(row, col, 'bold')
+        self._track_summary_header(col, header)
 
-    def _enter_format_country_date_data(self, country_orders: list, country: str, ref_col: int):
+    def _enter_format_country_date_data(self, currency: str, date: str, country: str, ref_col: int):
         '''add total, count, taxes for currency>date>country orders at self.row_cursor, ref_col, formats number format'''
-        self.s_ws.cell(self.row_cursor, ref_col).value = self._get_segment_total(country_orders)
-        self.s_ws.cell(self.row_cursor, ref_col).number_format = '#,##0.00'
-        self.s_ws.cell(self.row_cursor, ref_col + 1).value = len(country_orders)
-        self.s_ws.cell(self.row_cursor, ref_col + 2).value = self._calc_orders_taxes(country_orders, country)
-
-
-    def export(self, wb_name: str):
-        '''Creates workbook, and exports class objects: segments_orders_obj and summary_table_obj to
-        segment worksheets and creates report summary sheet, saves new workbook'''
-        self.wb = openpyxl.Workbook()
-        ws = self.wb.active
-        ws.title = SUMMARY_SHEET_NAME
-        for segment, segment_orders in self.segments_orders_obj.items():
-            self._data_to_sheet(segment, segment_orders)
+        self.s_ws.cell(self.row_cursor, ref_col).value = self.summary_cube.total(currency, date, 'eu', country)
+        self.styles.apply(self.row_cursor, ref_col, 'number')
+        self.s_ws.cell(self.row_cursor, ref_col + 1).value = self.summary_cube.count(currency, date, 'eu', country)
+        self.s_ws.cell(self.row_cursor, ref_col + 2).value = self.summary_cube.taxes(currency, date, 'eu', country)
+
+
+    def export(self, wb_name: str, writer_backend: str=DEFAULT_WRITER_BACKEND, compression_level: int=DEFAULT_COMPRESSION_LEVEL):
+        '''Streams class objects: segments_orders_obj (as planned in sheets_plan, oversized segments sharded) and
+        summary_table_obj to segment worksheets and report summary sheet through writer_backend (see report_writers),
+        saves new workbook. compression_level applies to direct backend'''
+        sheet_titles = [SUMMARY_SHEET_NAME] + [sheet_name for sheet_name, _ in self.sheets_plan]
+        self.writer = get_report_writer(writer_backend, wb_name, sheet_titles, compression_level)
+        for sheet_name, sheet_orders in self.sheets_plan:
+            self._data_to_sheet(sheet_name, sheet_orders)
         self.fill_format_summary()
-        self.wb.save(wb_name)
-        self.wb.close()
+        self.writer.write_styled_sheet(SUMMARY_SHEET_NAME, self.s_ws)
+        self.writer.save()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,318 @@
+import zipfile
+import copy
+from xml.sax.saxutils import escape, quoteattr
+import openpyxl
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+from openpyxl.styles import Alignment
+from openpyxl.styles.fonts import DEFAULT_FONT
+from openpyxl.styles.fills import DEFAULT_EMPTY_FILL, DEFAULT_GRAY_FILL
+from openpyxl.styles.borders import DEFAULT_BORDER
+from openpyxl.styles.numbers import BUILTIN_FORMATS_REVERSE
+from openpyxl.utils import get_column_letter, column_index_from_string, coordinate_to_tuple
+from openpyxl.xml.functions import tostring
+from openpyxl.compat import safe_string
+
+
+# GLOBAL VARIABLES
+WRITER_BACKENDS = ['direct', 'openpyxl']
+DEFAULT_WRITER_BACKEND = 'direct'
+# zip deflate levels: fast for daily runs, small for archival
+COMPRESSION_FAST = 1
+COMPRESSION_SMALL = 9
+DEFAULT_COMPRESSION_LEVEL = COMPRESSION_FAST
+# data sheet rows joined to single xml chunk before writing to zip stream
+ROWS_PER_CHUNK = 1000
+CUSTOM_NUM_FMT_START_ID = 164
+SPREADSHEETML_NS = 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'
+RELATIONSHIPS_NS = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+PACKAGE_RELS_NS = 'http://schemas.openxmlformats.org/package/2006/relationships'
+OFFICE_DOC_REL = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+XML_DECLARATION = '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+
+
+def get_report_writer(backend: str, wb_name: str, sheet_titles: list, compression_level: int=DEFAULT_COMPRESSION_LEVEL) -> object:
+    '''returns report writer for backend, writing workbook wb_name with sheets in sheet_titles order'''
+    if backend == 'direct':
+        return DirectXlsxWriter(wb_name, sheet_titles, compression_level)
+    elif backend == 'openpyxl':
+        return OpenpyxlWriter(wb_name, sheet_titles)
+    raise ValueError(f'Unexpected report writer backend: {backend}. Expected one of: {WRITER_BACKENDS}')
+
+def ws_to_write_only_ws(source_ws: object, target_ws: object):
+    '''streams in-memory source_ws cell values, cell styles, column widths and freeze panes to write-only target_ws'''
+    target_ws.freeze_panes = source_ws.freeze_panes
+    for col_letter, col_dimension in source_ws.column_dimensions.items():
+        if col_dimension.width:
+            target_ws.column_dimensions[col_letter].width = col_dimension.width
+    for row in source_ws.iter_rows():
+        target_ws.append([_to_write_only_cell(target_ws, cell) for cell in row])
+
+def _to_write_only_cell(target_ws: object, cell: object):
+    '''returns cell value for unstyled cell, styled WriteOnlyCell copy for target_ws otherwise'''
+    if not cell.has_style:
+        return cell.value
+    wo_cell = WriteOnlyCell(target_ws, value=cell.value)
+    wo_cell.font = copy.copy(cell.font)
+    wo_cell.fill = copy.copy(cell.fill)
+    wo_cell.border = copy.copy(cell.border)
+    wo_cell.alignment = copy.copy(cell.alignment)
+    wo_cell.number_format = cell.number_format
+    return wo_cell
+
+
+class OpenpyxlWriter():
+    '''Report writer through openpyxl write-only workbook. All sheets (sheet_titles) are created up front keeping
+    sheets order, filled as data arrives. Writer interface (same in DirectXlsxWriter):
+
+    write_data_sheet(title, header, rows, col_widths, freeze_panes) - unstyled header + rows of plain values
+
+    write_styled_sheet(title, source_ws) - copies in-memory (styled) openpyxl worksheet
+
+    save() - saves workbook to wb_name'''
+
+    def __init__(self, wb_name: str, sheet_titles: list):
+        self.wb_name = wb_name
+        self.wb = openpyxl.Workbook(write_only=True)
+        self.sheets = {title : self.wb.create_sheet(title=title) for title in sheet_titles}
+
+    def write_data_sheet(self, title: str, header: list, rows, col_widths: dict, freeze_panes: str=None):
+        ws = self.sheets[title]
+        ws.freeze_panes = freeze_panes
+        for col_letter, width in col_widths.items():
+            ws.column_dimensions[col_letter].width = width
+        ws.append(header)
+        for row in rows:
+            ws.append(row)
+
+    def write_styled_sheet(self, title: str, source_ws: object):
+        ws_to_write_only_ws(source_ws, self.sheets[title])
+
+    def save(self):
+        self.wb.save(self.wb_name)
+        self.wb.close()
+
+
+class DirectXlsxWriter():
+    '''Report writer emitting SpreadsheetML (xlsx) parts directly to zip streams, bypassing openpyxl object model.
+    Strings of all sheets are deduplicated to single shared strings table, styles of styled sheets are collected to
+    styles registry (cellXfs). Same writer interface as OpenpyxlWriter.
+
+    Arguments:
+
+    wb_name - output xlsx path
+
+    sheet_titles - sheet titles in workbook order. Sheets may be written in any order
+
+    compression_level - zip deflate level 0-9 (COMPRESSION_FAST / COMPRESSION_SMALL)'''
+
+    def __init__(self, wb_name: str, sheet_titles: list, compression_level: int=DEFAULT_COMPRESSION_LEVEL):
+        self.sheet_titles = list(sheet_titles)
+        self.sheet_ids = {title : idx + 1 for idx, title in enumerate(self.sheet_titles)}
+        self.zf = zipfile.ZipFile(wb_name, 'w', compression=zipfile.ZIP_DEFLATED, compresslevel=compression_level)
+        self.written_titles = set()
+        self.shared_strings = {}
+        self.shared_strings_count = 0
+        # style registries: object : index. Index 0 entries - defaults (unstyled cells)
+        self.fonts = {DEFAULT_FONT : 0}
+        self.fills = {DEFAULT_EMPTY_FILL : 0, DEFAULT_GRAY_FILL : 1}
+        self.borders = {DEFAULT_BORDER : 0}
+        self.num_fmts = {}
+        self.cell_xfs = {(0, 0, 0, 0, None) : 0}
+
+    def write_data_sheet(self, title: str, header: list, rows, col_widths: dict, freeze_panes: str=None):
+        self.written_titles.add(title)
+        col_refs = _ColumnRefs()
+        with self.zf.open(self._sheet_path(title), 'w') as f:
+            f.write(self._sheet_head(col_widths, freeze_panes).encode('utf-8'))
+            f.write(self._row_xml(1, header, col_refs).encode('utf-8'))
+            chunk = []
+            for row_idx, row in enumerate(rows, start=2):
+                chunk.append(self._row_xml(row_idx, row, col_refs))
+                if len(chunk) == ROWS_PER_CHUNK:
+                    f.write(''.join(chunk).encode('utf-8'))
+                    chunk = []
+            f.write(''.join(chunk).encode('utf-8'))
+            f.write('</sheetData></worksheet>'.encode('utf-8'))
+
+    def write_styled_sheet(self, title: str, source_ws: object):
+        self.written_titles.add(title)
+        col_widths = {col_letter : dim.width for col_letter, dim in source_ws.column_dimensions.items() if dim.width}
+        # source workbook style ids (cell.style_id) : cellXfs index, each distinct cell style resolved once per sheet
+        xf_idx_cache = {}
+        rows_xml = []
+        for row in source_ws.iter_rows():
+            cells_xml = [self._cell_xml(cell.coordinate, cell.value, self._get_cached_xf_idx(cell, xf_idx_cache)) for cell in row]
+            if any(cells_xml):
+                rows_xml.append(f'<row r="{row[0].row}">{"".join(cells_xml)}</row>')
+        with self.zf.open(self._sheet_path(title), 'w') as f:
+            f.write(self._sheet_head(col_widths, source_ws.freeze_panes).encode('utf-8'))
+            f.write(''.join(rows_xml).encode('utf-8'))
+            f.write('</sheetData></worksheet>'.encode('utf-8'))
+
+    def save(self):
+        '''writes workbook level parts (shared strings, styles, workbook, relationships), closes zip.
+        Sheets not written are saved empty'''
+        for title in self.sheet_titles:
+            if title not in self.written_titles:
+                self.write_data_sheet(title, [], [], {})
+        self._write_part('[Content_Types].xml', self._content_types_xml())
+        self._write_part('_rels/.rels', f'<Relationships xmlns="{PACKAGE_RELS_NS}">'
+                        f'<Relationship Id="rId1" Type="{OFFICE_DOC_REL}/officeDocument" Target="xl/workbook.xml"/></Relationships>')
+        self._write_part('xl/workbook.xml', self._workbook_xml())
+        self._write_part('xl/_rels/workbook.xml.rels', self._workbook_rels_xml())
+        self._write_part('xl/styles.xml', self._styles_xml())
+        self._write_part('xl/sharedStrings.xml', self._shared_strings_xml())
+        self.zf.close()
+
+    def _sheet_path(self, title: str) -> str:
+        return f'xl/worksheets/sheet{self.sheet_ids[title]}.xml'
+
+    def _write_part(self, path: str, xml: str):
+        self.zf.writestr(path, XML_DECLARATION + xml)
+
+    @staticmethod
+    def _sheet_head(col_widths: dict, freeze_panes: str) -> str:
+        '''returns worksheet xml up to (including) opening sheetData tag: sheet view (frozen panes), column widths'''
+        pane = ''
+        if freeze_panes:
+            row, col = coordinate_to_tuple(freeze_panes)
+            x_split = f' xSplit="{col - 1}"' if col > 1 else ''
+            y_split = f' ySplit="{row - 1}"' if row > 1 else ''
+            active_pane = {(True, True) : 'bottomRight', (False, True) : 'bottomLeft', (True, False) : 'topRight'}.get((col > 1, row > 1))
+            if active_pane:
+                pane = (f'<pane{x_split}{y_split} topLeftCell="{freeze_panes}" activePane="{active_pane}" state="frozen"/>'
+                        f'<selection pane="{active_pane}"/>')
+        cols = ''.join(f'<col min="{idx}" max="{idx}" width="{width}" customWidth="1"/>'
+                        for idx, width in sorted((column_index_from_string(col_letter), width) for col_letter, width in col_widths.items()))
+        return (XML_DECLARATION + f'<worksheet xmlns="{SPREADSHEETML_NS}" xmlns:r="{RELATIONSHIPS_NS}">'
+                f'<sheetViews><sheetView workbookViewId="0">{pane}</sheetView></sheetViews>'
+                f'<sheetFormatPr defaultRowHeight="15"/>{f"<cols>{cols}</cols>" if cols else ""}<sheetData>')
+
+    def _row_xml(self, row_idx: int, values, col_refs: object) -> str:
+        cells = ''.join(self._cell_xml(f'{col_refs[col_idx]}{row_idx}', value) for col_idx, value in enumerate(values))
+        return f'<row r="{row_idx}">{cells}</row>'
+
+    def _cell_xml(self, ref: str, value, xf_idx: int=0) -> str:
+        '''returns cell xml. Strings go to shared strings table. As in openpyxl: strings starting with '=' are formulas,
+        empty strings are written as empty cells'''
+        style = f' s="{xf_idx}"' if xf_idx else ''
+        if value is None or value == '':
+            return f'<c r="{ref}"{style}/>' if xf_idx else ''
+        if isinstance(value, bool):
+            return f'<c r="{ref}"{style} t="b"><v>{int(value)}</v></c>'
+        if isinstance(value, (int, float)):
+            # numbers formatted as in openpyxl ('%.16g')
+            return f'<c r="{ref}"{style}><v>{safe_string(value)}</v></c>'
+        value = str(value)
+        if value.startswith('=') and len(value) > 1:
+            return f'<c r="{ref}"{style}><f>{escape(value[1:])}</f><v></v></c>'
+        return f'<c r="{ref}"{style} t="s"><v>{self._get_shared_string_idx(value)}</v></c>'
+
+    def _get_shared_string_idx(self, value: str) -> int:
+        self.shared_strings_count += 1
+        idx = self.shared_strings.get(value)
+        if idx is None:
+            if ILLEGAL_CHARACTERS_RE.search(value):
+                raise ValueError(f'Cell value {value!r} contains characters not allowed in xlsx')
+            idx = len(self.shared_strings)
+            self.shared_strings[value] = idx
+        return idx
+
+    def _get_cached_xf_idx(self, cell: object, xf_idx_cache: dict) -> int:
+        if not cell.has_style:
+            return 0
+        # source workbook style index: same for cells with same font, fill, border, alignment, number format
+        style_key = cell.style_id
+        if style_key not in xf_idx_cache:
+            xf_idx_cache[style_key] = self._get_xf_idx(cell)
+        return xf_idx_cache[style_key]
+
+    def _get_xf_idx(self, cell: object) -> int:
+        '''returns cellXfs index of cell style, registering new fonts, fills, borders, number formats on first use'''
+        if not cell.has_style:
+            return 0
+        # cell style attributes are proxies (unhashable), copies are registered
+        alignment = copy.copy(cell.alignment) if cell.alignment != Alignment() else None
+        xf_key = (self._register(self.fonts, copy.copy(cell.font)), self._register(self.fills, copy.copy(cell.fill)),
+                self._register(self.borders, copy.copy(cell.border)), self._get_num_fmt_id(cell.number_format), alignment)
+        return self._register(self.cell_xfs, xf_key)
+
+    @staticmethod
+    def _register(registry: dict, item) -> int:
+        if item not in registry:
+            registry[item] = len(registry)
+        return registry[item]
+
+    def _get_num_fmt_id(self, number_format: str) -> int:
+        builtin_id = BUILTIN_FORMATS_REVERSE.get(number_format)
+        if builtin_id is not None:
+            return builtin_id
+        if number_format not in self.num_fmts:
+            self.num_fmts[number_format] = CUSTOM_NUM_FMT_START_ID + len(self.num_fmts)
+        return self.num_fmts[number_format]
+
+    def _styles_xml(self) -> str:
+        num_fmts = ''.join(f'<numFmt numFmtId="{fmt_id}" formatCode={quoteattr(fmt)}/>' for fmt, fmt_id in self.num_fmts.items())
+        num_fmts = f'<numFmts count="{len(self.num_fmts)}">{num_fmts}</numFmts>' if self.num_fmts else ''
+        xfs = []
+        for font_id, fill_id, border_id, num_fmt_id, alignment in self.cell_xfs:
+            apply = ''.join(f' {attr}="1"' for attr, idx in [('applyNumberFormat', num_fmt_id), ('applyFont', font_id),
+                                                            ('applyFill', fill_id), ('applyBorder', border_id)] if idx)
+            alignment_xml = tostring(alignment.to_tree()).decode('utf-8') if alignment else ''
+            apply += ' applyAlignment="1"' if alignment else ''
+            xfs.append(f'<xf numFmtId="{num_fmt_id}" fontId="{font_id}" fillId="{fill_id}" borderId="{border_id}" xfId="0"{apply}>'
+                        f'{alignment_xml}</xf>')
+        return (f'<styleSheet xmlns="{SPREADSHEETML_NS}">'
+                f'{num_fmts}'
+                f'{self._styles_list_xml("fonts", self.fonts)}{self._styles_list_xml("fills", self.fills)}'
+                f'{self._styles_list_xml("borders", self.borders)}'
+                '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+                f'<cellXfs count="{len(xfs)}">{"".join(xfs)}</cellXfs>'
+                '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+                '</styleSheet>')
+
+    @staticmethod
+    def _styles_list_xml(tag: str, registry: dict) -> str:
+        items = ''.join(tostring(item.to_tree()).decode('utf-8') for item in registry)
+        return f'<{tag} count="{len(registry)}">{items}</{tag}>'
+
+    def _shared_strings_xml(self) -> str:
+        items = ''.join(f'<si><t xml:space="preserve">{escape(value)}</t></si>' if value != value.strip() else f'<si><t>{escape(value)}</t></si>'
+                        for value in self.shared_strings)
+        return f'<sst xmlns="{SPREADSHEETML_NS}" count="{self.shared_strings_count}" uniqueCount="{len(self.shared_strings)}">{items}</sst>'
+
+    def _workbook_xml(self) -> str:
+        sheets = ''.join(f'<sheet name={quoteattr(title)} sheetId="{sheet_id}" r:id="rId{sheet_id}"/>'
+                        for title, sheet_id in self.sheet_ids.items())
+        return (f'<workbook xmlns="{SPREADSHEETML_NS}" xmlns:r="{RELATIONSHIPS_NS}">'
+                f'<bookViews><workbookView activeTab="0"/></bookViews><sheets>{sheets}</sheets></workbook>')
+
+    def _workbook_rels_xml(self) -> str:
+        rels = [f'<Relationship Id="rId{sheet_id}" Type="{OFFICE_DOC_REL}/worksheet" Target="worksheets/sheet{sheet_id}.xml"/>'
+                for sheet_id in self.sheet_ids.values()]
+        rels.append(f'<Relationship Id="rId{len(rels) + 1}" Type="{OFFICE_DOC_REL}/styles" Target="styles.xml"/>')
+        rels.append(f'<Relationship Id="rId{len(rels) + 1}" Type="{OFFICE_DOC_REL}/sharedStrings" Target="sharedStrings.xml"/>')
+        return f'<Relationships xmlns="{PACKAGE_RELS_NS}">{"".join(rels)}</Relationships>'
+
+    def _content_types_xml(self) -> str:
+        ml = 'application/vnd.openxmlformats-officedocument.spreadsheetml'
+        sheets = ''.join(f'<Override PartName="/{self._sheet_path(title)}" ContentType="{ml}.worksheet+xml"/>' for title in self.sheet_titles)
+        return ('<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+                '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+                '<Default Extension="xml" ContentType="application/xml"/>'
+                f'<Override PartName="/xl/workbook.xml" ContentType="{ml}.sheet.main+xml"/>'
+                f'<Override PartName="/xl/styles.xml" ContentType="{ml}.styles+xml"/>'
+                f'<Override PartName="/xl/sharedStrings.xml" ContentType="{ml}.sharedStrings+xml"/>'
+                f'{sheets}</Types>')
+
+
+class _ColumnRefs(dict):
+    '''zero indexed column index : column letter, computed once per column'''
+    def __missing__(self, col_idx: int) -> str:
+        self[col_idx] = get_column_letter(col_idx + 1)
+        return self[col_idx]
+
+
+if __name__ == "__main__":
+    pass
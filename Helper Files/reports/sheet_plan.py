@@ -0,0 +1,27 @@
+# GLOBAL VARIABLES
+EXCEL_MAX_ROWS = 1048576
+SEGMENT_HEADER_ROWS = 1
+
+
+def plan_segment_sheets(segments_orders: dict, max_rows: int=EXCEL_MAX_ROWS) -> list:
+    '''returns list of (sheet name, orders) for segment sheets, planned before any writing starts.
+    Segments exceeding max_rows (with header row) are sharded in file order: 'EU EUR (1)', 'EU EUR (2)', ...
+    Sheet orders are slices of segment lists (orders themselves are not copied)'''
+    max_data_rows = max_rows - SEGMENT_HEADER_ROWS
+    sheets_plan = []
+    for segment, segment_orders in segments_orders.items():
+        if len(segment_orders) <= max_data_rows:
+            sheets_plan.append((segment, segment_orders))
+            continue
+        for shard_idx, start in enumerate(range(0, len(segment_orders), max_data_rows)):
+            sheets_plan.append((f'{segment} ({shard_idx + 1})', segment_orders[start:start + max_data_rows]))
+    return sheets_plan
+
+def check_summary_rows(summary_rows: int, max_rows: int=EXCEL_MAX_ROWS):
+    '''raises ValueError before any writing starts if summary sheet would exceed max_rows'''
+    if summary_rows > max_rows:
+        raise ValueError(f'Summary sheet needs {summary_rows} rows, exceeding Excel limit of {max_rows} rows. Report not created')
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,76 @@
+import copy
+import openpyxl
+from openpyxl.styles import NamedStyle
+from openpyxl.styles.fonts import DEFAULT_FONT
+from openpyxl.styles.fills import DEFAULT_EMPTY_FILL
+from openpyxl.styles.borders import DEFAULT_BORDER
+
+
+# GLOBAL VARIABLES
+NUMBER_FORMAT = '#,##0.00'
+# summary styles: cell style attribute : value. Applied styles are layered on top of styles already applied to cell
+SUMMARY_STYLES = {
+    'bold' : {'font' : openpyxl.styles.Font(bold=True, name='Calibri')},
+    'background' : {'fill' : openpyxl.styles.PatternFill(fgColor='D6DEFF', fill_type='solid')},
+    'number' : {'number_format' : NUMBER_FORMAT},
+    'top_line' : {'border' : openpyxl.styles.Border(top=openpyxl.styles.Side(border_style='thin'))},
+}
+NAMED_STYLE_PREFIX = 'summary'
+
+
+class StyleRegistry():
+    '''Summary worksheet styles registry. Each distinct combination of summary styles applied to a cell is registered
+    once as workbook NamedStyle (named after its styles, e.g. 'summary bold background'), cells are assigned registered
+    style by name: no font / fill / border objects are built and hashed per cell. Main methods:
+
+    apply(row, col, *names) - layers summary styles on single cell
+
+    apply_cols(row, cols, *names), apply_row(row, min_col, max_col, *names),
+    apply_range(min_row, max_row, min_col, max_col, *names) - same for cells ranges (max inclusive)
+
+    Arguments:
+
+    ws - in-memory worksheet, styled through this registry only (styles applied to each cell are tracked here)
+
+    styles - name : {style attribute : value} dict, SUMMARY_STYLES by default'''
+
+    def __init__(self, ws: object, styles: dict=SUMMARY_STYLES):
+        self.ws = ws
+        self.styles = styles
+        # (row, col) : names of styles applied to cell, in application order
+        self._cell_names = {}
+        self._named_styles = set()
+
+    def apply(self, row: int, col: int, *names):
+        cell_names = tuple(name for name in self._cell_names.get((row, col), ()) if name not in names) + names
+        self._cell_names[(row, col)] = cell_names
+        self.ws.cell(row, col).style = self._get_named_style(cell_names)
+
+    def apply_cols(self, row: int, cols, *names):
+        for col in cols:
+            self.apply(row, col, *names)
+
+    def apply_row(self, row: int, min_col: int, max_col: int, *names):
+        self.apply_cols(row, range(min_col, max_col + 1), *names)
+
+    def apply_range(self, min_row: int, max_row: int, min_col: int, max_col: int, *names):
+        for row in range(min_row, max_row + 1):
+            self.apply_row(row, min_col, max_col, *names)
+
+    def _get_named_style(self, names: tuple) -> str:
+        '''returns name of workbook NamedStyle layering styles names (in order) over default cell style, registered on first use'''
+        style_name = ' '.join((NAMED_STYLE_PREFIX,) + names)
+        if style_name not in self._named_styles:
+            # NamedStyle defaults differ from unstyled cell's (font, border): layered over workbook defaults instead
+            named_style = NamedStyle(name=style_name, font=copy.copy(DEFAULT_FONT), fill=copy.copy(DEFAULT_EMPTY_FILL),
+                                    border=copy.copy(DEFAULT_BORDER), number_format='General')
+            for name in names:
+                for attr, value in self.styles[name].items():
+                    setattr(named_style, attr, copy.copy(value))
+            self.ws.parent.add_named_style(named_style)
+            self._named_styles.add(style_name)
+        return style_name
+
+
+if __name__ == "__main__":
+    pass
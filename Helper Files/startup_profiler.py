@@ -0,0 +1,77 @@
+import logging
+import atexit
+import time
+import sys
+
+# captured on first import: expected to be imported first in entry point module
+PROCESS_START = time.perf_counter()
+INITIAL_MODULES = set(sys.modules)
+
+
+# GLOBAL VARIABLES
+PROFILE_STARTUP_ARG = '--profile-startup'
+
+
+class StartupProfiler():
+    '''Cold-start profiler for main_accounting entry point. Records wall time and newly imported
+    top level packages for entry point imports and each named program stage. Main methods:
+
+    stage(name) - context manager timing program stage (recorded on exit() calls inside stage too)
+
+    report() - logs and prints (stderr, stdout is read by VBA) collected timings. Registered to run on interpreter exit
+    when enabled, so early exit paths (bad args, no new orders) are reported as well.
+
+    Arguments:
+
+    enabled - when False, stage() does no measuring, report() is never called'''
+
+    def __init__(self, enabled: bool=False):
+        self.enabled = enabled
+        self.stages = []
+        if self.enabled:
+            self._record('imports', PROCESS_START, INITIAL_MODULES)
+            atexit.register(self.report)
+
+    def stage(self, name: str):
+        return _ProfiledStage(self, name)
+
+    def _record(self, name: str, start: float, modules_before: set):
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        new_packages = sorted({module.split('.')[0] for module in set(sys.modules) - modules_before if not module.startswith('_')})
+        self.stages.append((name, elapsed_ms, new_packages))
+
+    def report(self):
+        '''logs and prints stage timings and packages imported during each stage'''
+        total_ms = (time.perf_counter() - PROCESS_START) * 1000
+        lines = [f'--- STARTUP PROFILE: {total_ms:.1f} ms total ---']
+        for name, elapsed_ms, new_packages in self.stages:
+            lines.append(f'{name:<16}{elapsed_ms:>10.1f} ms   imported: {", ".join(new_packages) or "-"}')
+        for line in lines:
+            logging.info(line)
+            print(line, file=sys.stderr)
+
+
+class _ProfiledStage():
+    '''context manager recording single StartupProfiler stage'''
+    def __init__(self, profiler: StartupProfiler, name: str):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        if self.profiler.enabled:
+            self.modules_before = set(sys.modules)
+            self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.profiler.enabled:
+            self.profiler._record(self.name, self.start, self.modules_before)
+        return False
+
+
+def pop_profile_startup_arg() -> bool:
+    '''removes PROFILE_STARTUP_ARG from sys.argv (not counted as expected cli arg), returns True if it was passed'''
+    if PROFILE_STARTUP_ARG in sys.argv:
+        sys.argv.remove(PROFILE_STARTUP_ARG)
+        return True
+    return False
@@ -0,0 +1,17 @@
+from .base import OrdersStorage
+
+
+# GLOBAL VARIABLES
+STORAGE_BACKENDS = ['sqlite3', 'sqlalchemy']
+
+
+def get_storage(backend: str, db_path: str) -> OrdersStorage:
+    '''returns orders storage backend instance for database at db_path.
+    Backend modules are imported on selection only (importing sqlalchemy is costly on startup)'''
+    if backend == 'sqlite3':
+        from .sqlite3_storage import SQLite3Storage
+        return SQLite3Storage(db_path)
+    elif backend == 'sqlalchemy':
+        from .sqlalchemy_storage import SQLAlchemyStorage
+        return SQLAlchemyStorage(db_path)
+    raise ValueError(f'Unexpected orders storage backend: {backend}. Expected one of: {STORAGE_BACKENDS}')
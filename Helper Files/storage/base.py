@@ -0,0 +1,110 @@
+import datetime
+import sqlite3
+import time
+from abc import ABC, abstractmethod
+
+
+# GLOBAL VARIABLES
+# connection profile, applied on each new connection
+SQLITE_PRAGMAS = {
+    'journal_mode' : 'WAL',
+    'synchronous' : 'NORMAL',
+    'cache_size' : -16000,          # negative value - KiB
+    'mmap_size' : 64 * 1024 * 1024,
+    'temp_store' : 'MEMORY',
+}
+# journal mode switch retries (see set_journal_mode)
+JOURNAL_MODE_RETRIES = 50
+JOURNAL_MODE_RETRY_DELAY = 0.1
+# schema version (PRAGMA user_version) : statements upgrading database from previous version
+SCHEMA_UPGRADES = {
+    1 : ['CREATE INDEX IF NOT EXISTS ix_program_run_timestamp ON program_run (timestamp)',
+        'CREATE INDEX IF NOT EXISTS ix_order_run ON "order" (run)',
+        'ALTER TABLE "order" ADD COLUMN sales_channel VARCHAR',
+        'UPDATE "order" SET sales_channel = (SELECT program_run.sales_channel FROM program_run WHERE program_run.id = "order".run)',
+        'CREATE INDEX IF NOT EXISTS ix_order_sales_channel_order_id ON "order" (sales_channel, order_id)'],
+    2 : ['ALTER TABLE program_run ADD COLUMN source_hash VARCHAR',
+        'CREATE INDEX IF NOT EXISTS ix_program_run_sales_channel_source_hash ON program_run (sales_channel, source_hash)'],
+    3 : ['ALTER TABLE program_run ADD COLUMN source_size INTEGER'],
+    4 : ['ALTER TABLE program_run ADD COLUMN confirmed BOOLEAN DEFAULT 1 NOT NULL'],
+}
+SCHEMA_VERSION = max(SCHEMA_UPGRADES)
+# program_run.timestamp text format (as stored by SQLAlchemy TIMESTAMP type on SQLite)
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+
+
+def set_journal_mode(dbapi_connection: object):
+    '''sets SQLITE_PRAGMAS journal mode (persistent, stored in database file) on sqlite3 connection before schema set-up.
+    Switching mode needs exclusive lock: processes opening same database for first time concurrently get
+    'database is locked' immediately (busy timeout is not waited on lock upgrade deadlock), switch is retried'''
+    for attempt in range(JOURNAL_MODE_RETRIES):
+        try:
+            dbapi_connection.execute(f"PRAGMA journal_mode = {SQLITE_PRAGMAS['journal_mode']}")
+            return
+        except sqlite3.OperationalError:
+            if attempt == JOURNAL_MODE_RETRIES - 1:
+                raise
+            time.sleep(JOURNAL_MODE_RETRY_DELAY)
+
+
+class OrdersStorage(ABC):
+    '''Orders database storage backend interface. Backends implement storage primitives over same on-disk
+    SQLite schema (tables: program_run, order), used by OrdersDB. Write methods run in single transaction,
+    rolling back and re-raising on failure.
+
+    Arguments:
+
+    db_path - abs path to SQLite database file. Database is created / upgraded to SCHEMA_VERSION on first use in process
+    '''
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+
+    @abstractmethod
+    def get_source_hashes(self, sales_channel: str, source_size: int, since: datetime.datetime) -> set:
+        '''returns source hashes of sales_channel runs with source_size added at or after since timestamp'''
+
+    @abstractmethod
+    def get_channel_order_ids(self, sales_channel: str) -> set:
+        '''returns set of order ids in database for sales_channel'''
+
+    @abstractmethod
+    def get_new_order_ids(self, sales_channel: str, incoming_order_ids: set) -> set:
+        '''returns incoming_order_ids not present in database for sales_channel (anti-joined inside database)'''
+
+    @abstractmethod
+    def add_run_orders(self, run_row: dict, order_rows: list) -> tuple:
+        '''inserts new run (run_row keys: fpath, sales_channel, timestamp, source_hash, source_size, confirmed) and its orders
+        (order_rows without run column) skipping ids already in database. Returns new run id, count of inserted orders'''
+
+    @abstractmethod
+    def confirm_run(self, run_id: int):
+        '''marks run with run_id as confirmed (its report was exported)'''
+
+    @abstractmethod
+    def delete_run(self, run_id: int) -> int:
+        '''deletes run with run_id and its orders. Returns count of deleted orders'''
+
+    @abstractmethod
+    def get_oldest_run_timestamp(self) -> datetime.datetime:
+        '''returns timestamp of oldest run, None if database has no runs'''
+
+    @abstractmethod
+    def delete_runs_before(self, timestamp: datetime.datetime) -> tuple:
+        '''deletes runs added before timestamp and their orders. Returns deleted runs [(id, fpath), ...], {run id: orders count}'''
+
+    @abstractmethod
+    def delete_unconfirmed_runs_before(self, timestamp: datetime.datetime) -> dict:
+        '''deletes unconfirmed runs added before timestamp and their orders. Returns {deleted run id: orders count}'''
+
+    @abstractmethod
+    def get_referenced_fpaths(self, fpaths: set) -> set:
+        '''returns fpaths still referenced by runs in database'''
+
+    @abstractmethod
+    def close(self, failed: bool=False):
+        '''releases connection. failed flag - closing after unexpected error'''
+
+
+if __name__ == "__main__":
+    pass
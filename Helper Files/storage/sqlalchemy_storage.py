@@ -0,0 +1,275 @@
+import datetime
+import logging
+import threading
+import atexit
+import sqlalchemy.sql.default_comparator    #neccessary for executable packing
+from sqlalchemy import create_engine, event, Column, String, Integer, Boolean, Index, MetaData, Table, select, exists, and_, insert, delete, update, func, text
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import sessionmaker, relationship
+from sqlalchemy.pool import QueuePool, NullPool
+from sqlalchemy.sql.sqltypes import TIMESTAMP
+from sqlalchemy.sql.schema import ForeignKey
+from .base import OrdersStorage, SQLITE_PRAGMAS, SCHEMA_UPGRADES, SCHEMA_VERSION, set_journal_mode
+
+
+# GLOBAL VARIABLES
+# process wide engine connection pool
+POOL_SIZE = 5
+POOL_MAX_OVERFLOW = 5
+
+
+Base = declarative_base()
+
+
+class ProgramRun(Base):
+    '''database table model representing unique program run'''
+    __tablename__ = 'program_run'
+    __table_args__ = (Index('ix_program_run_timestamp', 'timestamp'),
+                    Index('ix_program_run_sales_channel_source_hash', 'sales_channel', 'source_hash'))
+
+    def __init__(self, fpath:str, sales_channel, timestamp=None, **kwargs):
+        super(ProgramRun, self).__init__(**kwargs)
+        self.fpath = fpath
+        self.sales_channel = sales_channel
+        self.timestamp = timestamp or datetime.datetime.now()
+
+    id = Column(Integer, primary_key=True, nullable=False)
+    fpath = Column(String, nullable=False)
+    sales_channel = Column(String, nullable=False)      # AmazonEU / AmazonCOM / Amazon Warehouse
+    timestamp = Column(TIMESTAMP(timezone=False), default=datetime.datetime.now)
+    source_hash = Column(String)        # sha256 of source file contents
+    source_size = Column(Integer)       # source file size in bytes, cheap pre-check before hashing
+    confirmed = Column(Boolean, nullable=False, default=True, server_default=text('1'))     # False while claimed run's report is exported
+    orders = relationship('Order', cascade='all, delete', cascade_backrefs=True,
+                passive_deletes=False, passive_updates=False, backref='run_obj')
+
+    def __repr__(self) -> str:
+        return f'<ProgramRun id: {self.id}, sales_channel: {self.sales_channel}, timestamp: {self.timestamp}, fpath: {self.fpath}, source_hash: {self.source_hash}>'
+    
+
+class Order(Base):
+    '''database table model representing Order
+    
+    NOTE: unique primary key is:
+        order['order-item-id'] for Amazon (AmazonEU / AmazonCOM);
+        order['Shipment Item ID'] for Amazon Warehouse;
+
+        order_id_secondary:
+        order['order-id'] for Amazon;
+        order['Amazon Order Id'] for Amazon Warehouse;
+    '''
+    __tablename__ = 'order'
+    __table_args__ = (Index('ix_order_run', 'run'),
+                    # covering index for channel order ids lookups
+                    Index('ix_order_sales_channel_order_id', 'sales_channel', 'order_id'))
+
+    def __init__(self, order_id, purchase_date, buyer_name, run, **kwargs):
+        super(Order, self).__init__(**kwargs)
+        self.order_id = order_id
+        self.purchase_date = purchase_date
+        self.buyer_name = buyer_name
+        self.run = run
+
+    order_id = Column(String, primary_key=True, nullable=False)
+    order_id_secondary = Column(String)
+    purchase_date = Column(String)
+    buyer_name = Column(String)
+    run = Column(Integer, ForeignKey('program_run.id', ondelete='CASCADE', onupdate='CASCADE'), nullable=False)
+    sales_channel = Column(String)      # denormalized program_run.sales_channel
+
+    def __repr__(self) -> str:
+        return f'<Order order_id: {self.order_id}, added on run: {self.run}>'
+
+
+# process wide engines (db path : engine), shared by all storage instances and runs in same process
+_ENGINES = {}
+_ENGINES_LOCK = threading.Lock()
+Session = sessionmaker()
+
+
+def get_engine(db_path:str) -> object:
+    '''returns process wide pooled engine for database at db_path. Engine is created, database schema created / upgraded on first call'''
+    with _ENGINES_LOCK:
+        engine = _ENGINES.get(db_path)
+        if engine is None:
+            engine = _create_engine(db_path)
+            _ENGINES[db_path] = engine
+        return engine
+
+def dispose_engine(db_path:str=None):
+    '''closes pooled connections and forgets engine for db_path (all engines if db_path not provided)'''
+    with _ENGINES_LOCK:
+        db_paths = [db_path] if db_path else list(_ENGINES)
+        for path in db_paths:
+            engine = _ENGINES.pop(path, None)
+            if engine is not None:
+                engine.dispose()
+                logging.debug(f'Disposed database engine for {path}')
+
+def _create_engine(db_path:str) -> object:
+    '''returns new pooled engine with connection profile applied, database schema set up'''
+    _set_up_schema(db_path)
+    engine = create_engine(f'sqlite:///{db_path}', echo=False, poolclass=QueuePool, pool_size=POOL_SIZE,
+                            max_overflow=POOL_MAX_OVERFLOW, connect_args={'check_same_thread': False})
+    event.listen(engine, 'connect', _apply_connection_profile)
+    return engine
+
+def _set_up_schema(db_path:str):
+    '''creates database schema or upgrades it in place to SCHEMA_VERSION on separate unpooled migration engine.
+    pysqlite does not begin transaction before DDL, so migration engine disables pysqlite transaction handling and
+    emits BEGIN IMMEDIATE itself: each step (DDL, backfill, user_version) commits or rolls back together
+    and processes setting up same database on first run are serialized'''
+    migration_engine = create_engine(f'sqlite:///{db_path}', echo=False, poolclass=NullPool)
+    event.listen(migration_engine, 'connect', _begin_manually)
+    event.listen(migration_engine, 'begin', _begin_immediate)
+    try:
+        with migration_engine.connect() as conn:
+            set_journal_mode(conn.connection)
+            db_version = conn.exec_driver_sql('PRAGMA user_version').scalar()
+            db_has_tables = _has_tables(conn)
+        if not db_has_tables:
+            with migration_engine.begin() as conn:
+                # state is re-read inside transaction: concurrent process may have set up database meanwhile
+                if not _has_tables(conn):
+                    Base.metadata.create_all(bind=conn)
+                    conn.exec_driver_sql(f'PRAGMA user_version = {SCHEMA_VERSION}')
+                    logging.info(f'Database has been created at {db_path}')
+        for version in range(db_version + 1, SCHEMA_VERSION + 1):
+            with migration_engine.begin() as conn:
+                if conn.exec_driver_sql('PRAGMA user_version').scalar() < version:
+                    for statement in SCHEMA_UPGRADES[version]:
+                        conn.exec_driver_sql(statement)
+                    conn.exec_driver_sql(f'PRAGMA user_version = {version}')
+                    logging.info(f'Database schema upgraded to version {version}')
+    finally:
+        migration_engine.dispose()
+
+def _has_tables(conn:object) -> bool:
+    return bool(conn.exec_driver_sql("SELECT count(*) FROM sqlite_master WHERE type = 'table'").scalar())
+
+def _begin_manually(dbapi_connection, connection_record):
+    '''disables pysqlite own transaction handling (it does not begin transactions before DDL)'''
+    dbapi_connection.isolation_level = None
+
+def _begin_immediate(conn):
+    conn.exec_driver_sql('BEGIN IMMEDIATE')
+
+def _apply_connection_profile(dbapi_connection, connection_record):
+    '''applies SQLITE_PRAGMAS to new database connection'''
+    cursor = dbapi_connection.cursor()
+    for pragma, value in SQLITE_PRAGMAS.items():
+        cursor.execute(f'PRAGMA {pragma} = {value}')
+    cursor.close()
+
+atexit.register(dispose_engine)
+
+
+class SQLAlchemyStorage(OrdersStorage):
+    '''SQLAlchemy ORM orders storage backend. Uses process wide pooled engine (get_engine), session per instance'''
+
+    def __init__(self, db_path: str):
+        super().__init__(db_path)
+        self.engine = get_engine(db_path)
+        self.session = Session(bind=self.engine)
+
+    def get_source_hashes(self, sales_channel: str, source_size: int, since: datetime.datetime) -> set:
+        source_hashes_since = select(ProgramRun.source_hash).where(and_(ProgramRun.sales_channel == sales_channel,
+                                                                        ProgramRun.source_size == source_size,
+                                                                        ProgramRun.timestamp >= since))
+        return {source_hash for source_hash, in self.session.execute(source_hashes_since)}
+
+    def get_channel_order_ids(self, sales_channel: str) -> set:
+        db_order_ids_of_sales_channel = self.session.query(Order.order_id).filter(Order.sales_channel==sales_channel)
+        return {order_id for order_id, in db_order_ids_of_sales_channel}
+
+    def get_new_order_ids(self, sales_channel: str, incoming_order_ids: set) -> set:
+        incoming_ids_table = Table('incoming_order_id', MetaData(), Column('order_id', String, primary_key=True), prefixes=['TEMPORARY'])
+        connection = self.session.connection()
+        incoming_ids_table.create(bind=connection)
+        try:
+            connection.execute(incoming_ids_table.insert(), [{'order_id' : order_id} for order_id in incoming_order_ids])
+            channel_order_exists = exists().where(and_(Order.sales_channel == sales_channel,
+                                                        Order.order_id == incoming_ids_table.c.order_id))
+            new_ids_query = select(incoming_ids_table.c.order_id).where(~channel_order_exists)
+            return {order_id for order_id, in connection.execute(new_ids_query)}
+        finally:
+            incoming_ids_table.drop(bind=connection)
+            # commit drop, otherwise closing session rolls it back, leaving table on pooled connection
+            self.session.commit()
+
+    def add_run_orders(self, run_row: dict, order_rows: list) -> tuple:
+        try:
+            new_run = ProgramRun(**run_row)
+            self.session.add(new_run)
+            self.session.flush()
+            self.session.execute(insert(Order).prefix_with('OR IGNORE'), [{**order_row, 'run' : new_run.id} for order_row in order_rows])
+            added_count = self.session.query(func.count(Order.order_id)).filter(Order.run == new_run.id).scalar()
+            self.session.commit()
+            return new_run.id, added_count
+        except Exception:
+            self.session.rollback()
+            raise
+
+    def confirm_run(self, run_id: int):
+        try:
+            self.session.execute(update(ProgramRun).where(ProgramRun.id == run_id).values(confirmed=True).execution_options(synchronize_session=False))
+            self.session.commit()
+        except Exception:
+            self.session.rollback()
+            raise
+
+    def delete_run(self, run_id: int) -> int:
+        try:
+            deleted_count = self.session.execute(delete(Order).where(Order.run == run_id).execution_options(synchronize_session=False)).rowcount
+            self.session.execute(delete(ProgramRun).where(ProgramRun.id == run_id).execution_options(synchronize_session=False))
+            self.session.commit()
+            return deleted_count
+        except Exception:
+            self.session.rollback()
+            raise
+
+    def get_oldest_run_timestamp(self) -> datetime.datetime:
+        return self.session.execute(select(func.min(ProgramRun.timestamp))).scalar()
+
+    def delete_runs_before(self, timestamp: datetime.datetime) -> tuple:
+        try:
+            old_runs = self.session.execute(select(ProgramRun.id, ProgramRun.fpath).where(ProgramRun.timestamp < timestamp)).all()
+            if not old_runs:
+                return [], {}
+            old_run_ids = select(ProgramRun.id).where(ProgramRun.timestamp < timestamp)
+            orders_per_run = dict(self.session.execute(select(Order.run, func.count()).where(Order.run.in_(old_run_ids)).group_by(Order.run)).all())
+            self.session.execute(delete(Order).where(Order.run.in_(old_run_ids)).execution_options(synchronize_session=False))
+            self.session.execute(delete(ProgramRun).where(ProgramRun.timestamp < timestamp).execution_options(synchronize_session=False))
+            self.session.commit()
+            return [tuple(run) for run in old_runs], orders_per_run
+        except Exception:
+            self.session.rollback()
+            raise
+
+    def delete_unconfirmed_runs_before(self, timestamp: datetime.datetime) -> dict:
+        try:
+            stale_run_ids = select(ProgramRun.id).where(and_(ProgramRun.confirmed == False, ProgramRun.timestamp < timestamp))
+            stale_runs = {run_id : 0 for run_id, in self.session.execute(stale_run_ids)}
+            if not stale_runs:
+                return {}
+            stale_runs.update(self.session.execute(select(Order.run, func.count()).where(Order.run.in_(stale_run_ids)).group_by(Order.run)).all())
+            self.session.execute(delete(Order).where(Order.run.in_(stale_run_ids)).execution_options(synchronize_session=False))
+            self.session.execute(delete(ProgramRun).where(ProgramRun.id.in_(stale_run_ids)).execution_options(synchronize_session=False))
+            self.session.commit()
+            return stale_runs
+        except Exception:
+            self.session.rollback()
+            raise
+
+    def get_referenced_fpaths(self, fpaths: set) -> set:
+        return {fpath for fpath, in self.session.execute(select(ProgramRun.fpath).where(ProgramRun.fpath.in_(fpaths)))}
+
+    def close(self, failed: bool=False):
+        '''closes session, returning its connection to shared engine pool. Failure also disposes pooled connections'''
+        self.session.close()
+        if failed:
+            dispose_engine(self.db_path)
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,190 @@
+import contextlib
+import datetime
+import logging
+import threading
+import sqlite3
+from .base import OrdersStorage, SQLITE_PRAGMAS, SCHEMA_UPGRADES, SCHEMA_VERSION, TIMESTAMP_FORMAT, set_journal_mode
+
+
+# GLOBAL VARIABLES
+# SCHEMA_VERSION schema, same as created by SQLAlchemy models (storage.sqlalchemy_storage)
+SCHEMA_STATEMENTS = [
+    '''CREATE TABLE program_run (
+	id INTEGER NOT NULL,
+	fpath VARCHAR NOT NULL,
+	sales_channel VARCHAR NOT NULL,
+	timestamp TIMESTAMP,
+	source_hash VARCHAR,
+	source_size INTEGER,
+	confirmed BOOLEAN DEFAULT 1 NOT NULL,
+	PRIMARY KEY (id)
+)''',
+    'CREATE INDEX ix_program_run_timestamp ON program_run (timestamp)',
+    'CREATE INDEX ix_program_run_sales_channel_source_hash ON program_run (sales_channel, source_hash)',
+    '''CREATE TABLE "order" (
+	order_id VARCHAR NOT NULL,
+	order_id_secondary VARCHAR,
+	purchase_date VARCHAR,
+	buyer_name VARCHAR,
+	run INTEGER NOT NULL,
+	sales_channel VARCHAR,
+	PRIMARY KEY (order_id),
+	FOREIGN KEY(run) REFERENCES program_run (id) ON DELETE CASCADE ON UPDATE CASCADE
+)''',
+    'CREATE INDEX ix_order_sales_channel_order_id ON "order" (sales_channel, order_id)',
+    'CREATE INDEX ix_order_run ON "order" (run)',
+]
+ORDER_COLUMNS = ['order_id', 'order_id_secondary', 'purchase_date', 'buyer_name', 'sales_channel']
+
+# databases, set up (created / upgraded) in this process
+_SET_UP_DB_PATHS = set()
+_SET_UP_LOCK = threading.Lock()
+
+
+def _set_up_db(db_path: str):
+    '''creates database schema or upgrades it to SCHEMA_VERSION, once per process for db_path.
+    Runs on dedicated autocommit connection (isolation_level=None): sqlite3 module does not begin transaction before DDL
+    itself, therefore each step is explicit BEGIN IMMEDIATE ... COMMIT, committing or rolling back DDL, backfill and
+    user_version together. BEGIN IMMEDIATE also serializes processes setting up same database on first run'''
+    with _SET_UP_LOCK:
+        if db_path in _SET_UP_DB_PATHS:
+            return
+        conn = sqlite3.connect(db_path, isolation_level=None)
+        try:
+            set_journal_mode(conn)
+            db_version = conn.execute('PRAGMA user_version').fetchone()[0]
+            if not _has_tables(conn):
+                with _immediate_transaction(conn):
+                    # state is re-read inside transaction: concurrent process may have set up database meanwhile
+                    if not _has_tables(conn):
+                        for statement in SCHEMA_STATEMENTS:
+                            conn.execute(statement)
+                        conn.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+                        logging.info(f'Database has been created at {db_path}')
+            for version in range(db_version + 1, SCHEMA_VERSION + 1):
+                with _immediate_transaction(conn):
+                    if conn.execute('PRAGMA user_version').fetchone()[0] < version:
+                        for statement in SCHEMA_UPGRADES[version]:
+                            conn.execute(statement)
+                        conn.execute(f'PRAGMA user_version = {version}')
+                        logging.info(f'Database schema upgraded to version {version}')
+        finally:
+            conn.close()
+        _SET_UP_DB_PATHS.add(db_path)
+
+def _has_tables(conn: object) -> bool:
+    return bool(conn.execute("SELECT count(*) FROM sqlite_master WHERE type = 'table'").fetchone()[0])
+
+@contextlib.contextmanager
+def _immediate_transaction(conn: object):
+    '''explicit write transaction on autocommit connection: commits on success, rolls back and re-raises on failure'''
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        yield
+    except BaseException:
+        conn.execute('ROLLBACK')
+        raise
+    conn.execute('COMMIT')
+
+
+class SQLite3Storage(OrdersStorage):
+    '''Standard library sqlite3 orders storage backend (no SQLAlchemy import). Connection per instance,
+    database schema set up on first connection in process'''
+
+    def __init__(self, db_path: str):
+        super().__init__(db_path)
+        self.conn = self._connect()
+
+    def _connect(self) -> object:
+        '''returns new connection with SQLITE_PRAGMAS applied and database schema set up'''
+        _set_up_db(self.db_path)
+        conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        try:
+            for pragma, value in SQLITE_PRAGMAS.items():
+                conn.execute(f'PRAGMA {pragma} = {value}')
+        except Exception:
+            conn.close()
+            raise
+        return conn
+
+    def get_source_hashes(self, sales_channel: str, source_size: int, since: datetime.datetime) -> set:
+        query = 'SELECT source_hash FROM program_run WHERE sales_channel = ? AND source_size = ? AND timestamp >= ?'
+        return {source_hash for source_hash, in self.conn.execute(query, (sales_channel, source_size, since.strftime(TIMESTAMP_FORMAT)))}
+
+    def get_channel_order_ids(self, sales_channel: str) -> set:
+        return {order_id for order_id, in self.conn.execute('SELECT order_id FROM "order" WHERE sales_channel = ?', (sales_channel,))}
+
+    def get_new_order_ids(self, sales_channel: str, incoming_order_ids: set) -> set:
+        with self.conn:
+            self.conn.execute('DROP TABLE IF EXISTS incoming_order_id')
+            self.conn.execute('CREATE TEMPORARY TABLE incoming_order_id (order_id VARCHAR NOT NULL, PRIMARY KEY (order_id))')
+            try:
+                self.conn.executemany('INSERT INTO incoming_order_id (order_id) VALUES (?)', ((order_id,) for order_id in incoming_order_ids))
+                new_ids_query = '''SELECT order_id FROM incoming_order_id WHERE NOT EXISTS
+                                (SELECT 1 FROM "order" WHERE "order".sales_channel = ? AND "order".order_id = incoming_order_id.order_id)'''
+                return {order_id for order_id, in self.conn.execute(new_ids_query, (sales_channel,))}
+            finally:
+                self.conn.execute('DROP TABLE incoming_order_id')
+
+    def add_run_orders(self, run_row: dict, order_rows: list) -> tuple:
+        timestamp = run_row.get('timestamp') or datetime.datetime.now()
+        with self.conn:
+            cursor = self.conn.execute('INSERT INTO program_run (fpath, sales_channel, timestamp, source_hash, source_size, confirmed) VALUES (?, ?, ?, ?, ?, ?)',
+                                    (run_row['fpath'], run_row['sales_channel'], timestamp.strftime(TIMESTAMP_FORMAT),
+                                    run_row.get('source_hash'), run_row.get('source_size'), run_row.get('confirmed', True)))
+            run_id = cursor.lastrowid
+            insert_statement = f'INSERT OR IGNORE INTO "order" ({", ".join(ORDER_COLUMNS)}, run) VALUES ({", ".join("?" * len(ORDER_COLUMNS))}, ?)'
+            self.conn.executemany(insert_statement, ([order_row[column] for column in ORDER_COLUMNS] + [run_id] for order_row in order_rows))
+            added_count = self.conn.execute('SELECT count(*) FROM "order" WHERE run = ?', (run_id,)).fetchone()[0]
+        return run_id, added_count
+
+    def confirm_run(self, run_id: int):
+        with self.conn:
+            self.conn.execute('UPDATE program_run SET confirmed = 1 WHERE id = ?', (run_id,))
+
+    def delete_run(self, run_id: int) -> int:
+        with self.conn:
+            deleted_count = self.conn.execute('DELETE FROM "order" WHERE run = ?', (run_id,)).rowcount
+            self.conn.execute('DELETE FROM program_run WHERE id = ?', (run_id,))
+        return deleted_count
+
+    def get_oldest_run_timestamp(self) -> datetime.datetime:
+        oldest_run_timestamp = self.conn.execute('SELECT min(timestamp) FROM program_run').fetchone()[0]
+        return datetime.datetime.fromisoformat(oldest_run_timestamp) if oldest_run_timestamp else None
+
+    def delete_runs_before(self, timestamp: datetime.datetime) -> tuple:
+        before = timestamp.strftime(TIMESTAMP_FORMAT)
+        with self.conn:
+            old_runs = self.conn.execute('SELECT id, fpath FROM program_run WHERE timestamp < ?', (before,)).fetchall()
+            if not old_runs:
+                return [], {}
+            old_run_ids = 'SELECT id FROM program_run WHERE timestamp < ?'
+            orders_per_run = dict(self.conn.execute(f'SELECT run, count(*) FROM "order" WHERE run IN ({old_run_ids}) GROUP BY run', (before,)))
+            self.conn.execute(f'DELETE FROM "order" WHERE run IN ({old_run_ids})', (before,))
+            self.conn.execute('DELETE FROM program_run WHERE timestamp < ?', (before,))
+        return old_runs, orders_per_run
+
+    def delete_unconfirmed_runs_before(self, timestamp: datetime.datetime) -> dict:
+        stale_run_ids = 'SELECT id FROM program_run WHERE NOT confirmed AND timestamp < ?'
+        before = timestamp.strftime(TIMESTAMP_FORMAT)
+        with self.conn:
+            stale_runs = {run_id : 0 for run_id, in self.conn.execute(stale_run_ids, (before,))}
+            if not stale_runs:
+                return {}
+            stale_runs.update(self.conn.execute(f'SELECT run, count(*) FROM "order" WHERE run IN ({stale_run_ids}) GROUP BY run', (before,)))
+            self.conn.execute(f'DELETE FROM "order" WHERE run IN ({stale_run_ids})', (before,))
+            self.conn.execute('DELETE FROM program_run WHERE NOT confirmed AND timestamp < ?', (before,))
+        return stale_runs
+
+    def get_referenced_fpaths(self, fpaths: set) -> set:
+        fpaths = list(fpaths)
+        query = f'SELECT fpath FROM program_run WHERE fpath IN ({", ".join("?" * len(fpaths))})'
+        return {fpath for fpath, in self.conn.execute(query, fpaths)} if fpaths else set()
+
+    def close(self, failed: bool=False):
+        '''closes connection, uncommitted changes are rolled back'''
+        self.conn.close()
+
+
+if __name__ == "__main__":
+    pass
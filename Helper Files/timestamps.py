@@ -0,0 +1,27 @@
+from functools import lru_cache
+from datetime import datetime
+
+
+# GLOBAL VARIABLES
+# distinct raw timestamp strings memoized. Amazon timestamps repeat heavily within a day
+TIMESTAMP_CACHE_SIZE = 65536
+
+
+@lru_cache(maxsize=TIMESTAMP_CACHE_SIZE)
+def parse_timestamp(raw: str) -> datetime:
+    '''returns tz-naive datetime (offset dropped, not converted) from raw timestamp string, memoized by raw string.
+    Fixed layout fast path for 2020-04-16T10:07:16+00:00, datetime.fromisoformat otherwise. Raises ValueError'''
+    if len(raw) == 25 and raw[10] == 'T' and raw[19] in '+-' and raw[4] == raw[7] == '-' and raw[13] == raw[16] == raw[22] == ':':
+        digits = raw[:4] + raw[5:7] + raw[8:10] + raw[11:13] + raw[14:16] + raw[17:19] + raw[20:22] + raw[23:]
+        if digits.isascii() and digits.isdigit():
+            return datetime(int(raw[:4]), int(raw[5:7]), int(raw[8:10]), int(raw[11:13]), int(raw[14:16]), int(raw[17:19]))
+    return datetime.fromisoformat(raw).replace(tzinfo=None)
+
+@lru_cache(maxsize=TIMESTAMP_CACHE_SIZE)
+def timestamp_to_date_str(raw: str) -> str:
+    '''returns simplified YYYY-MM-DD date of raw timestamp string, memoized by raw string. Raises ValueError'''
+    return parse_timestamp(raw).strftime('%Y-%m-%d')
+
+
+if __name__ == "__main__":
+    pass